@@ -1,11 +1,35 @@
+import csv
+from datetime import date
+from decimal import Decimal
+
+from django.contrib import admin, messages
+from django.db import models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import redirect, render
 from django.urls import path
-from django.utils.safestring import mark_safe
-from django.shortcuts import render, redirect
-from django.contrib import admin
 from django.utils import timezone
-from .models import Client, Conversation, Message, Muhbir, UsageLimit, APIKey
-from .utils import get_ai_response, token_size_calculate, avarage_request_token_size
-from django.conf import settings
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from .cache import get_stats
+from .forms import ExcelUploadForm
+from .importers import import_articles
+from .models import (
+    AiData,
+    APIKey,
+    Category,
+    CategoryStats,
+    Client,
+    Conversation,
+    DailyUsageRollup,
+    FeedCursor,
+    Message,
+    Muhbir,
+    UsageLimit,
+)
+from .utils import get_ai_response
 
 
 # APIKey Admin
@@ -16,6 +40,21 @@ class APIKeyAdmin(admin.ModelAdmin):
     list_filter = ("is_active",)
     search_fields = ("key",)
 
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path(
+                "cache-stats/",
+                self.admin_site.admin_view(self.cache_stats_view),
+                name="cache_stats",
+            ),
+        ]
+        return custom_urls + urls
+
+    def cache_stats_view(self, request):
+        """Hit/miss counters of the app caches for the worker serving this request."""
+        return JsonResponse(get_stats())
+
 
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
@@ -145,20 +184,6 @@ class ClientAdmin(admin.ModelAdmin):
     list_filter = ("is_muhbir", "created_at")
 
 
-def calculate_tokens(content):
-    """
-    Estimate the number of tokens used based on the content length.
-    This is a simplified approximation.
-    """
-    return len(content) // 4  # Adjust as needed based on your tokenization strategy
-
-
-from django.db import models
-
-from functools import lru_cache
-from django.db.models import Avg, Sum, F, Count
-
-
 @admin.register(UsageLimit)
 class UsageLimitAdmin(admin.ModelAdmin):
     list_display = (
@@ -169,52 +194,126 @@ class UsageLimitAdmin(admin.ModelAdmin):
     )
     list_filter = ("is_muhbir",)
 
-    def total_output_tokens(self, obj):
+    def get_queryset(self, request):
         """
-        Calculate the total output tokens used by AI overall.
+        Read the totals from the daily usage rollup, once per changelist
+        query; its size grows with days, not with messages.
         """
-        # Filter messages sent by AI and calculate total tokens
-        messages = Message.objects.filter(
-            conversation__client__is_muhbir=obj.is_muhbir,
-            sender="ai",
+        totals = (
+            DailyUsageRollup.objects.filter(
+                is_muhbir=OuterRef("is_muhbir"), sender="ai"
+            )
+            .order_by()
+            .values("is_muhbir")
         )
-
-        total_output_tokens = sum(
-            calculate_tokens(message.content) + 5 for message in messages
+        return (
+            super()
+            .get_queryset(request)
+            .annotate(
+                output_tokens=Coalesce(
+                    Subquery(
+                        totals.annotate(total=Sum("output_tokens")).values("total")
+                    ),
+                    0,
+                ),
+                cost=Coalesce(
+                    Subquery(totals.annotate(total=Sum("cost")).values("total")),
+                    Decimal(0),
+                    output_field=models.DecimalField(),
+                ),
+            )
         )
 
-        return total_output_tokens
+    def total_output_tokens(self, obj):
+        """
+        Calculate the total output tokens used by AI overall.
+        """
+        return obj.output_tokens
 
     def price(self, obj):
         """
-        Calculate the total cost based on output tokens.
+        Total cost of the input and output tokens of AI answers.
         """
-        total_output_tokens = self.total_output_tokens(obj)
+        return f"{obj.cost:.4f} $"  # Total price
 
-        # Calculate price based on output tokens only
-        output_price = (
-            total_output_tokens / 1_000_000
-        ) * 0.600  # Cost for output tokens
+    total_output_tokens.short_description = "Total Output Tokens (AI)"
+    total_output_tokens.admin_order_field = "output_tokens"
+    price.short_description = "Total Cost"
+    price.admin_order_field = "cost"
 
-        return f"{output_price:.4f} $"  # Total price
 
-    total_output_tokens.short_description = "Total Output Tokens (AI)"
-    price.short_description = "Total Cost (Output Only)"
+@admin.register(DailyUsageRollup)
+class DailyUsageRollupAdmin(admin.ModelAdmin):
+    list_display = (
+        "date",
+        "is_muhbir",
+        "api_key_id",
+        "sender",
+        "message_count",
+        "input_tokens",
+        "output_tokens",
+        "cost",
+    )
+    list_filter = ("is_muhbir", "sender", "date")
+    date_hierarchy = "date"
 
+    def has_add_permission(self, request):
+        return False
 
-from django.urls import path
-from django.shortcuts import render, redirect
-from django.contrib import admin, messages
-import pandas as pd
-from .models import AiData, Category
-from .forms import ExcelUploadForm
-from django.utils.html import format_html
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        custom_urls = [
+            path(
+                "export/",
+                self.admin_site.admin_view(self.export_view),
+                name="usage_rollup_export",
+            ),
+        ]
+        return custom_urls + super().get_urls()
+
+    def export_view(self, request):
+        """
+        Export rollup rows as CSV (or JSON with ?format=json), optionally
+        limited with ?from=YYYY-MM-DD and ?to=YYYY-MM-DD.
+        """
+        rows = DailyUsageRollup.objects.order_by("date", "is_muhbir", "sender")
+        try:
+            if request.GET.get("from"):
+                rows = rows.filter(date__gte=date.fromisoformat(request.GET["from"]))
+            if request.GET.get("to"):
+                rows = rows.filter(date__lte=date.fromisoformat(request.GET["to"]))
+        except ValueError:
+            return JsonResponse({"error": "Dates must be YYYY-MM-DD."}, status=400)
+
+        fields = [
+            "date",
+            "is_muhbir",
+            "api_key_id",
+            "sender",
+            "message_count",
+            "input_tokens",
+            "output_tokens",
+            "cost",
+        ]
+        rows = rows.values_list(*fields)
+
+        if request.GET.get("format") == "json":
+            return JsonResponse({"rows": [dict(zip(fields, row)) for row in rows]})
+
+        response = HttpResponse(content_type="text/csv")
+        response["Content-Disposition"] = 'attachment; filename="usage.csv"'
+        writer = csv.writer(response)
+        writer.writerow(fields)
+        writer.writerows(rows.iterator())
+        return response
 
 
 @admin.register(AiData)
 class AiDataAdmin(admin.ModelAdmin):
     list_display = ("id", "heading", "content")
-    search_fields = ("heading",)
+    search_fields = ("heading", "link")
 
     # Add a custom URL for the upload form
     def get_urls(self):
@@ -240,11 +339,9 @@ class AiDataAdmin(admin.ModelAdmin):
             if form.is_valid():
                 excel_file = request.FILES["excel_file"]
                 try:
-                    # Read data from Excel file
-                    df = self.read_excel_data(excel_file)
-
-                    # Validate and write data to the database
-                    self.write_data_to_db(df, request)
+                    # Stream the workbook and write it with bulk inserts
+                    result = import_articles(excel_file)
+                    self.report_import(request, result)
                     return redirect("..")
                 except Exception as e:
                     messages.error(request, f"Error processing file: {e}")
@@ -254,48 +351,20 @@ class AiDataAdmin(admin.ModelAdmin):
         context = {"form": form}
         return render(request, "admin/upload_data.html", context)
 
-    # Method to read Excel data
-    def read_excel_data(self, excel_file):
-        """
-        Reads the Excel file and returns a DataFrame.
-        Raises an exception if there's an issue reading the file.
-        """
-        df = pd.read_excel(excel_file)
-
-        # Check for required columns
-        required_columns = ["heading", "content", "category"]
-        if all(column in df.columns for column in required_columns):
-            return df
-        else:
-            raise ValueError(
-                "The Excel file must contain 'heading', 'content', and 'category' columns."
-            )
-
-    def write_data_to_db(self, df, request):
-        """
-        Writes the data from the DataFrame to the AiData model.
-        Handles multiple categories for each article.
-        Automatically creates any category that doesn't exist.
-        """
-        for index, row in df.iterrows():
-            # Create the article
-            article = AiData.objects.create(
-                heading=row["heading"], content=row["content"]
+    def report_import(self, request, result, max_errors=20):
+        messages.success(
+            request,
+            f"Data uploaded successfully! {result.created} of {result.rows} rows "
+            f"imported, {result.duplicates} already existed, "
+            f"{result.categories_created} new categories.",
+        )
+        for number, error in result.errors[:max_errors]:
+            messages.warning(request, f"Row {number} skipped: {error}")
+        if len(result.errors) > max_errors:
+            messages.warning(
+                request, f"... and {len(result.errors) - max_errors} more rows skipped."
             )
 
-            # Handle categories, split by commas
-            category_names = row["category"].split(",")
-            for category_name in category_names:
-                category_name = category_name.strip()  # Remove any extra spaces
-
-                # Check if the category exists, if not create it
-                category, created = Category.objects.get_or_create(name=category_name)
-
-                # Add the category to the article
-                article.categories.add(category)
-
-        messages.success(request, "Data uploaded successfully!")
-
     # Add a method to display the link on the changelist page
     def changelist_upload_button(self, obj):
         return format_html(
@@ -306,6 +375,29 @@ class AiDataAdmin(admin.ModelAdmin):
     changelist_upload_button.short_description = "Upload Data"
 
 
+@admin.register(CategoryStats)
+class CategoryStatsAdmin(admin.ModelAdmin):
+    list_display = (
+        "category",
+        "article_count",
+        "heading_tokens",
+        "content_tokens",
+        "updated_at",
+    )
+    list_select_related = ("category",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(FeedCursor)
+class FeedCursorAdmin(admin.ModelAdmin):
+    list_display = ("name", "high_water", "updated_at")
+
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = (
@@ -1,3 +1,5 @@
+from api.providers import gemini_model, gemini_request_options
+
 function_declaration = {
     "name": "get_data",
     "description": "Fetches the content by id",
@@ -19,17 +21,16 @@ def get_id(id: int):
 
 
 def get_id_gemin(content: str, user_message: str):
-    from api.utils import genai
-
-    model = genai.GenerativeModel(
-        model_name="gemini-1.5-flash-latest",
-        generation_config=genai.types.GenerationConfigDict(
-            {"temperature": 0.7, "max_output_tokens": 500}
-        ),
-        system_instruction=content,
-        tools=[get_id],
-    )
+    model = gemini_model(content, tools=[get_id])
     response = model.generate_content(
-        user_message,
+        user_message, request_options=gemini_request_options()
+    )
+    return response.text
+
+
+async def get_id_gemin_async(content: str, user_message: str):
+    model = gemini_model(content, tools=[get_id])
+    response = await model.generate_content_async(
+        user_message, request_options=gemini_request_options()
     )
     return response.text
@@ -1,27 +1,27 @@
 from openai import OpenAI
-from api.utils import client
+from api.utils import client, async_client
 
-
-def get_id_gpt(content, user_message):
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "getData",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "id": {"type": "integer"},
-                    },
-                    "required": [
-                        "id",
-                    ],
-                    "additionalProperties": False,
+tools = [
+    {
+        "type": "function",
+        "function": {
+            "name": "getData",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "integer"},
                 },
+                "required": [
+                    "id",
+                ],
+                "additionalProperties": False,
             },
-        }
-    ]
+        },
+    }
+]
+
 
+def get_id_gpt(content, user_message):
     # Call the GPT API
     completion = client.chat.completions.create(
         model="gpt-4o",
@@ -37,3 +37,19 @@ def get_id_gpt(content, user_message):
 
     # Extract and return the tool calls and user message
     return completion.choices[0].message.content
+
+
+async def get_id_gpt_async(content, user_message):
+    completion = await async_client.chat.completions.create(
+        model="gpt-4o",
+        messages=[
+            {
+                "role": "system",
+                "content": content + "Use the supplied tools to assist the user.",
+            },
+            {"role": "user", "content": user_message},
+        ],
+        tools=tools,
+    )
+
+    return completion.choices[0].message.content
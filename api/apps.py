@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .tokenizer import get_tokenizer
+
+        # Fail at startup, not in a request, if the tokenizer cannot be loaded
+        get_tokenizer()
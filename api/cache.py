@@ -0,0 +1,241 @@
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+# Sentinel so that cached "not found" results can be told apart from misses
+MISSING = object()
+
+_stats_lock = threading.Lock()
+_stats = defaultdict(lambda: {"hits": 0, "misses": 0})
+
+
+def record(namespace, hit):
+    """
+    Count a cache hit or miss for the given namespace (per process).
+    """
+    with _stats_lock:
+        _stats[namespace]["hits" if hit else "misses"] += 1
+
+
+def get_stats():
+    """
+    Return a snapshot of hit/miss counters and hit rate for every namespace.
+    """
+    with _stats_lock:
+        snapshot = {name: dict(counts) for name, counts in _stats.items()}
+
+    for counts in snapshot.values():
+        total = counts["hits"] + counts["misses"]
+        counts["hit_rate"] = round(counts["hits"] / total, 4) if total else 0.0
+    return snapshot
+
+
+def make_key(namespace, value):
+    """
+    Build a cache key that is safe for every backend, whatever the raw value contains.
+    """
+    digest = hashlib.md5(str(value).encode("utf-8")).hexdigest()
+    return f"{namespace}:{digest}"
+
+
+def get_or_load(namespace, value, loader, timeout):
+    """
+    Return the cached result for `value`, calling `loader()` and caching its
+    result on a miss. `None` results are cached too, so lookups of missing
+    rows do not hit the database on every call.
+    """
+    key = make_key(namespace, value)
+    result = cache.get(key, MISSING)
+    if result is not MISSING:
+        record(namespace, hit=True)
+        return result
+
+    record(namespace, hit=False)
+    result = loader()
+    cache.set(key, result, timeout)
+    return result
+
+
+def invalidate(namespace, value):
+    cache.delete(make_key(namespace, value))
+
+
+def lookup(namespace, value, default=None):
+    """
+    Return the shared cache entry for `value`, or `default` if there is none.
+    """
+    return cache.get(make_key(namespace, value), default)
+
+
+def lookup_many(namespace, values):
+    """
+    Return {value: entry} for those of `values` that have an entry, in one
+    round trip.
+    """
+    keys = {make_key(namespace, value): value for value in values}
+    return {keys[key]: entry for key, entry in cache.get_many(list(keys)).items()}
+
+
+def store(namespace, value, result, timeout):
+    cache.set(make_key(namespace, value), result, timeout)
+
+
+def add(namespace, value, result, timeout):
+    """
+    Store `result` unless `value` has an entry already. Atomic across the
+    processes sharing the cache, so it can serve as a lock; returns whether
+    the entry was stored.
+    """
+    return cache.add(make_key(namespace, value), result, timeout)
+
+
+def incr(namespace, value, delta=1):
+    """
+    Add `delta` to the integer entry of `value`, atomically across processes,
+    and return the new value. Raises ValueError if there is no entry.
+    """
+    return cache.incr(make_key(namespace, value), delta)
+
+
+def _version_key(namespace):
+    return f"version:{namespace}"
+
+
+# Versions read from the shared cache: namespace -> (version, monotonic time read)
+_versions_lock = threading.Lock()
+_versions = {}
+
+
+def _remember_version(namespace, version):
+    with _versions_lock:
+        _versions[namespace] = (version, time.monotonic())
+    return version
+
+
+def get_version(namespace):
+    """
+    Return the current version of a namespace of cached data. The version is
+    the invalidation channel between processes: the shared cache holds it,
+    and every process re-reads it at most CACHE_VERSION_CHECK_INTERVAL
+    seconds after its last read, so the local caches keyed by it (article
+    and answer caches, retrieval indexes) follow a bump made anywhere.
+    """
+    with _versions_lock:
+        version, read_at = _versions.get(namespace, (None, 0))
+    if (
+        version is not None
+        and time.monotonic() - read_at < settings.CACHE_VERSION_CHECK_INTERVAL
+    ):
+        return version
+
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock, so a version lost from the cache never goes
+        # back to a value that older entries were stored under
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return _remember_version(namespace, version)
+
+
+def bump_version(namespace):
+    """
+    Move a namespace to a new version, so everything cached under the old one
+    is ignored and rebuilt lazily on next use. Returns the new version.
+    """
+    try:
+        version = cache.incr(_version_key(namespace))
+    except ValueError:
+        with _versions_lock:
+            _versions.pop(namespace, None)
+        return get_version(namespace)
+    return _remember_version(namespace, version)
+
+
+def get_or_load_versioned(namespace, value, loader, timeout):
+    """
+    Like get_or_load, but the entry belongs to the current version of the namespace.
+    """
+    version = get_version(namespace)
+    return get_or_load(namespace, f"{version}:{value}", loader, timeout)
+
+
+class LRUCache:
+    """
+    In-process cache that evicts the least recently used entries once the
+    total size of its values exceeds `max_bytes`. Hits and misses are
+    recorded under `namespace`.
+
+    With `shared_timeout`, entries are also written to the shared cache for
+    that many seconds and local misses are looked up there, so an entry set
+    by one process is found by all; `clear` only clears this process.
+    """
+
+    def __init__(self, namespace, max_bytes, shared_timeout=None):
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.shared_timeout = shared_timeout
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, size)
+        self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def sizeof(value):
+        if isinstance(value, str):
+            return len(value.encode("utf-8"))
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.shared_timeout is not None:
+            value = cache.get(make_key(self.namespace, key), MISSING)
+            if value is not MISSING:
+                self._store(key, value)
+                entry = (value,)
+        record(self.namespace, hit=entry is not None)
+        return default if entry is None else entry[0]
+
+    def set(self, key, value):
+        if self.shared_timeout is not None:
+            cache.set(make_key(self.namespace, key), value, self.shared_timeout)
+        self._store(key, value)
+
+    def _store(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._delete(key)
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def delete(self, key):
+        if self.shared_timeout is not None:
+            cache.delete(make_key(self.namespace, key))
+        with self._lock:
+            self._delete(key)
+
+    def _delete(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
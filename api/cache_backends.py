@@ -0,0 +1,181 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+_MISSING = object()
+
+
+class SQLiteCache(BaseCache):
+    """
+    Cache in a SQLite file that every worker and service on this host opens,
+    so they all see the same entries: a version bumped by one process is
+    read by the others. `add` and `incr` run in write transactions, so they
+    are atomic across processes, which the version keys and the write-behind
+    counters rely on.
+
+    Integers are stored as SQLite integers so `incr` is done by SQLite;
+    other values are pickled.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.path = location
+        self._cull_every = int(params.get("OPTIONS", {}).get("CULL_EVERY", 100))
+        self._local = threading.local()
+
+    @property
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            # Connections are not shared across a fork (gunicorn preload)
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value BLOB, expires REAL)"
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @staticmethod
+    def _encode(value):
+        if type(value) is int and -(2**63) <= value < 2**63:
+            return value
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _decode(value):
+        return value if isinstance(value, int) else pickle.loads(value)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._connection.execute(
+            "SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return default if row is None else self._decode(row[0])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._connection.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, self._encode(value), self.get_backend_timeout(timeout)),
+        )
+        self._cull()
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        connection = self._connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "DELETE FROM cache WHERE key = ? AND expires <= ?", (key, now)
+            )
+            added = connection.execute(
+                "INSERT OR IGNORE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, self._encode(value), self.get_backend_timeout(timeout)),
+            ).rowcount
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return bool(added)
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            updated = connection.execute(
+                "UPDATE cache SET value = value + ? WHERE key = ? "
+                "AND typeof(value) = 'integer' AND (expires IS NULL OR expires > ?)",
+                (delta, key, time.time()),
+            ).rowcount
+            row = connection.execute(
+                "SELECT value FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        if not updated:
+            raise ValueError(f"Key '{key}' not found.")
+        return row[0]
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return bool(
+            self._connection.execute(
+                "UPDATE cache SET expires = ? WHERE key = ? "
+                "AND (expires IS NULL OR expires > ?)",
+                (self.get_backend_timeout(timeout), key, time.time()),
+            ).rowcount
+        )
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return bool(
+            self._connection.execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount
+        )
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def clear(self):
+        self._connection.execute("DELETE FROM cache")
+
+    def _cull(self):
+        """
+        Every CULL_EVERY writes, drop expired entries and, past MAX_ENTRIES,
+        the 1/CULL_FREQUENCY entries that expire soonest.
+        """
+        self._local.writes = getattr(self._local, "writes", 0) + 1
+        if self._local.writes % self._cull_every:
+            return
+        connection = self._connection
+        connection.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+        (count,) = connection.execute("SELECT COUNT(*) FROM cache").fetchone()
+        if count > self._max_entries:
+            connection.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+                "WHERE expires IS NOT NULL ORDER BY expires LIMIT ?)",
+                (count // self._cull_frequency,),
+            )
+
+
+def cache_settings(url):
+    """
+    CACHES["default"] for a CACHE_URL: "sqlite:///relative/path" or
+    "sqlite:////absolute/path" (shared by the processes of one host),
+    "redis://host:port/db" (shared by every host, needs the redis package)
+    or "locmem://" (one process only).
+    """
+    scheme = urlsplit(url).scheme
+    if scheme == "sqlite":
+        return {
+            "BACKEND": "api.cache_backends.SQLiteCache",
+            "LOCATION": urlsplit(url).path[1:],
+            "OPTIONS": {"MAX_ENTRIES": 100000},
+        }
+    if scheme in ("redis", "rediss", "unix"):
+        return {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": url,
+        }
+    if scheme == "locmem":
+        return {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": urlsplit(url).netloc or "unique-snowflake",
+        }
+    raise ValueError(f"Unsupported CACHE_URL: {url}")
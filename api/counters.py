@@ -0,0 +1,144 @@
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from django.apps import apps
+from django.db import connection
+from django.db.models import F
+
+from . import cache
+
+logger = logging.getLogger("daryo-api")
+
+
+class WriteBehindCounter:
+    """
+    Accumulates increments of an integer model field in memory and writes them
+    back with one `F()` UPDATE per row, once `flush_size` increments are pending
+    and at the latest `flush_interval` seconds after the first of them, from a
+    timer thread, so an idle process does not hold them back.
+
+    The live value of each row is kept in the cache (seeded from the database
+    plus whatever is still pending here), so limits can be enforced without
+    touching the database on every call. It does not expire: seeded again, it
+    would miss the increments other processes have not flushed yet.
+    """
+
+    def __init__(self, model_label, field, flush_interval=5, flush_size=100):
+        self.model_label = model_label
+        self.field = field
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        self._lock = threading.Lock()
+        self._pending = defaultdict(int)
+        self._pending_total = 0
+        self._timer = None
+
+        atexit.register(self.flush)
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    def _cache_key(self, pk):
+        return f"{self.model_label}:{self.field}:{pk}"
+
+    def _seed(self, pk):
+        """
+        Put the current value of the row into the cache if it is not there yet.
+        """
+        stored = (
+            self.model.objects.filter(pk=pk).values_list(self.field, flat=True).first()
+        )
+        with self._lock:
+            pending = self._pending.get(pk, 0)
+        cache.add("counter", self._cache_key(pk), (stored or 0) + pending, None)
+
+    def value(self, pk):
+        """
+        Return the live value of the field, including increments not yet flushed.
+        """
+        current = cache.lookup("counter", self._cache_key(pk))
+        if current is None:
+            self._seed(pk)
+            current = cache.lookup("counter", self._cache_key(pk), 0)
+        return current
+
+    def incr(self, pk, delta=1):
+        """
+        Add `delta` to the field and return the new live value.
+        """
+        key = self._cache_key(pk)
+        try:
+            current = cache.incr("counter", key, delta)
+        except ValueError:
+            # Not cached yet (or evicted): seed from the database and retry
+            self._seed(pk)
+            current = cache.incr("counter", key, delta)
+
+        with self._lock:
+            self._pending[pk] += delta
+            self._pending_total += abs(delta)
+            due = self._pending_total >= self.flush_size
+            if not due:
+                self._schedule_flush()
+        if due:
+            self.flush()
+        return current
+
+    def _schedule_flush(self):
+        """
+        Start the timer for the next flush unless one is running. Called with
+        the lock held.
+        """
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self._flush_later)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_later(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        finally:
+            # The timer thread's own database connection
+            connection.close()
+
+    def reset(self, pk):
+        """
+        Forget the live value so it is re-read from the database on next use,
+        e.g. after the row was edited in the admin.
+        """
+        cache.invalidate("counter", self._cache_key(pk))
+
+    def flush(self):
+        """
+        Write all pending increments to the database.
+        """
+        with self._lock:
+            pending = {pk: delta for pk, delta in self._pending.items() if delta}
+            self._pending.clear()
+            self._pending_total = 0
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        if not pending:
+            return
+
+        model = self.model
+        for pk, delta in pending.items():
+            try:
+                model.objects.filter(pk=pk).update(**{self.field: F(self.field) + delta})
+            except Exception:
+                logger.exception(
+                    f"Failed to flush {self.model_label}.{self.field} for pk={pk}"
+                )
+                # Keep the increment so it is written on the next flush
+                with self._lock:
+                    self._pending[pk] += delta
+                    self._pending_total += abs(delta)
+                    self._schedule_flush()
@@ -0,0 +1,268 @@
+import datetime
+import io
+import logging
+import re
+import urllib.request
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from itertools import islice
+from pathlib import Path
+
+from django.db import transaction
+from django.utils import timezone
+
+from .importers import (
+    LINK_CONFLICT,
+    catalog_changed,
+    link_categories,
+    resolve_categories,
+    upsert_articles,
+)
+from .models import AiData, CategoryStats, FeedCursor
+
+logger = logging.getLogger("daryo-api")
+
+# Items of a feed dump are separated by a line of dashes
+SEPARATOR_RE = re.compile(r"^-{3,}\s*$")
+FIELD_RE = re.compile(r"^(Title|Link|Description|Published Date|Categories):\s?(.*)$")
+
+
+@dataclass
+class FeedItem:
+    title: str
+    link: str
+    description: str
+    published: object = None  # aware datetime, None if missing or unparsable
+    categories: list = field(default_factory=list)
+
+    @property
+    def link_hash(self):
+        return AiData.hash_link(self.link)
+
+
+@dataclass
+class FeedResult:
+    items: int = 0
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0  # also new links whose article is stored already
+    skipped: int = 0  # older than the high-water mark
+    errors: int = 0  # new links another run stored meanwhile, see upsert_articles
+    categories_created: int = 0
+    high_water: object = None
+
+
+def open_source(source):
+    """
+    Open a feed dump given as a file path or an http(s)/file URL, as a text
+    stream that is read lazily.
+    """
+    if re.match(r"^(https?|file)://", source):
+        response = urllib.request.urlopen(source, timeout=30)
+        return io.TextIOWrapper(response, encoding="utf-8", errors="replace")
+    return Path(source).open(encoding="utf-8", errors="replace")
+
+
+def parse_feed(lines):
+    """
+    Yield a FeedItem for every article of a Daryo feed dump (see text.txt):
+    "Title:", "Link:", a multi-line "Description:", "Published Date:" and
+    comma separated "Categories:" fields, items separated by dashes. The
+    channel header and items without a title or link are left out.
+    """
+    fields = {}
+    current = None
+
+    def item():
+        if not fields.get("Title") or not fields.get("Link"):
+            return None
+        try:
+            published = parsedate_to_datetime(fields.get("Published Date", ""))
+        except (TypeError, ValueError):
+            published = None
+        if published is not None and timezone.is_naive(published):
+            published = published.replace(tzinfo=datetime.timezone.utc)
+        return FeedItem(
+            title=fields["Title"].strip(),
+            link=fields["Link"].strip(),
+            description=" ".join(fields.get("Description", "").split()),
+            published=published,
+            categories=[
+                name.strip()
+                for name in fields.get("Categories", "").split(",")
+                if name.strip()
+            ],
+        )
+
+    for line in lines:
+        line = line.rstrip("\n")
+        if SEPARATOR_RE.match(line):
+            parsed = item()
+            if parsed is not None:
+                yield parsed
+            fields, current = {}, None
+            continue
+
+        match = FIELD_RE.match(line)
+        if match:
+            current = match.group(1)
+            fields[current] = match.group(2)
+        elif current == "Description":
+            fields[current] += "\n" + line
+
+    parsed = item()
+    if parsed is not None:
+        yield parsed
+
+
+def batched(items, size):
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def upsert_items(items, category_ids, result):
+    """
+    Insert the items whose link is new and update the ones whose title,
+    text or categories changed, with bulk queries. Returns the ids of the
+    articles whose text was written.
+    """
+    result.categories_created += resolve_categories(
+        (name for item in items for name in item.categories), category_ids
+    )
+
+    # The same link twice in one batch: the later copy wins
+    items = list({item.link_hash: item for item in items}.values())
+    existing = {
+        article.link_hash: article
+        for article in AiData.objects.filter(
+            link_hash__in=[item.link_hash for item in items]
+        ).only("id", "heading", "content", "link", "link_hash")
+    }
+    current_categories = {}
+    for article_id, category_id in AiData.categories.through.objects.filter(
+        aidata_id__in=[article.id for article in existing.values()]
+    ).values_list("aidata_id", "category_id"):
+        current_categories.setdefault(article_id, set()).add(category_id)
+
+    new_rows = []
+    changed = []
+    relinked = []
+    touched = set()  # categories of updated articles, before and after
+    for item in items:
+        wanted = {category_ids[name] for name in item.categories}
+        article = existing.get(item.link_hash)
+        if article is None:
+            new_rows.append(
+                (
+                    AiData(
+                        heading=item.title,
+                        content=item.description,
+                        link=item.link,
+                        link_hash=item.link_hash,
+                    ),
+                    wanted,
+                )
+            )
+            continue
+
+        text_changed = (article.heading, article.content) != (
+            item.title,
+            item.description,
+        )
+        categories_changed = current_categories.get(article.id, set()) != wanted
+        if text_changed:
+            article.heading = item.title
+            article.content = item.description
+            article.update_token_counts()
+            article.update_content_hash()
+            changed.append(article)
+        if categories_changed:
+            relinked.append((article.id, wanted))
+        if text_changed or categories_changed:
+            touched |= current_categories.get(article.id, set()) | wanted
+            result.updated += 1
+        else:
+            result.unchanged += 1
+
+    upserted = upsert_articles(new_rows)
+    for (article, _), (article_id, created) in zip(new_rows, upserted):
+        if article_id is None:
+            logger.warning(f"Feed item {article.link}: {LINK_CONFLICT}")
+            result.errors += 1
+        elif created:
+            result.created += 1
+        else:
+            result.unchanged += 1
+
+    # An edit that turns an article into a copy of another one is left out
+    taken = set(
+        AiData.objects.filter(
+            content_hash__in=[article.content_hash for article in changed]
+        )
+        .exclude(id__in=[article.id for article in changed])
+        .values_list("content_hash", flat=True)
+    )
+    unique_changed = {}
+    for article in changed:
+        if article.content_hash in taken or article.content_hash in unique_changed:
+            logger.warning(f"Feed item {article.link} duplicates another article")
+            continue
+        unique_changed[article.content_hash] = article
+    AiData.objects.bulk_update(
+        unique_changed.values(),
+        ["heading", "content", "heading_tokens", "content_tokens", "content_hash"],
+    )
+    updated_ids = [article.id for article in unique_changed.values()]
+    transaction.on_commit(lambda: AiData.changed(updated_ids))
+    if relinked:
+        AiData.categories.through.objects.filter(
+            aidata_id__in=[article_id for article_id, _ in relinked]
+        ).delete()
+        link_categories(relinked)
+    CategoryStats.refresh(touched)
+    return [article_id for article_id, created in upserted if created] + updated_ids
+
+
+def ingest_feed(lines, name="daryo", batch_size=200, full=False):
+    """
+    Upsert the articles of a feed dump in batches, deduplicated by link.
+    Items published before the feed's high-water mark (FeedCursor) are
+    skipped unless `full`; the mark is moved to the newest item once the
+    whole feed is processed.
+    """
+    result = FeedResult()
+    cursor, _ = FeedCursor.objects.get_or_create(name=name)
+    high_water = None if full else cursor.high_water
+    result.high_water = cursor.high_water
+    category_ids = {}
+    written_ids = []
+
+    def fresh(items):
+        for item in items:
+            result.items += 1
+            if high_water and item.published and item.published < high_water:
+                result.skipped += 1
+                continue
+            if item.published and (
+                result.high_water is None or item.published > result.high_water
+            ):
+                result.high_water = item.published
+            yield item
+
+    for batch in batched(fresh(parse_feed(lines)), batch_size):
+        with transaction.atomic():
+            written_ids += upsert_items(batch, category_ids, result)
+
+    if result.created or result.updated:
+        catalog_changed(written_ids)
+
+    if result.high_water != cursor.high_water:
+        cursor.high_water = result.high_water
+        cursor.save(update_fields=["high_water", "updated_at"])
+
+    logger.info(
+        f"Feed {name}: {result.created} created, {result.updated} updated, "
+        f"{result.skipped} skipped, {result.errors} errors of {result.items} items"
+    )
+    return result
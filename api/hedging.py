@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+logger = logging.getLogger("daryo-api")
+
+
+class LatencyTracker:
+    """
+    Durations of the last `window` successful calls of a provider.
+    """
+
+    def __init__(self, window=200):
+        self._lock = threading.Lock()
+        self._durations = deque(maxlen=window)
+
+    def __len__(self):
+        return len(self._durations)
+
+    def add(self, duration):
+        with self._lock:
+            self._durations.append(duration)
+
+    def percentile(self, q):
+        with self._lock:
+            durations = sorted(self._durations)
+        if not durations:
+            return None
+        return durations[min(len(durations) - 1, math.ceil(q * len(durations)) - 1)]
+
+
+def hedge_delay(tracker):
+    """
+    Seconds to wait for the primary provider before asking the secondary one:
+    its p95 latency once there are LLM_HEDGE_MIN_SAMPLES calls, LLM_HEDGE_DELAY
+    until then.
+    """
+    if len(tracker) < settings.LLM_HEDGE_MIN_SAMPLES:
+        return settings.LLM_HEDGE_DELAY
+    return tracker.percentile(0.95)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.LLM_HEDGE_WORKERS, thread_name_prefix="hedge"
+            )
+    return _executor
+
+
+class Hedged:
+    """
+    Call `primary(*args)`; if it has not answered after the hedge delay (or has
+    failed), call `secondary(*args)` too and return whichever answer comes
+    first. Only a failure of both is raised.
+
+    A provider call running in a thread cannot be interrupted, so the losing
+    call is left to finish in the background and its result is dropped.
+    """
+
+    def __init__(self, primary, secondary, tracker=None):
+        self.primary = primary
+        self.secondary = secondary
+        self.tracker = tracker if tracker is not None else LatencyTracker()
+        self.__name__ = f"hedged_{primary.__name__}_{secondary.__name__}"
+
+    def _timed(self, func, *args):
+        started = time.monotonic()
+        result = func(*args)
+        if func is self.primary:
+            self.tracker.add(time.monotonic() - started)
+        return result
+
+    def __call__(self, *args):
+        executor = get_executor()
+        primary = executor.submit(self._timed, self.primary, *args)
+        done, _ = wait([primary], timeout=hedge_delay(self.tracker))
+        if done and primary.exception() is None:
+            return primary.result()
+
+        logger.info(f"{self.__name__}: primary slow or failed, asking secondary")
+        pending = {primary, executor.submit(self._timed, self.secondary, *args)}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+        raise error
+
+
+class AsyncHedged(Hedged):
+    """
+    Hedged for coroutine functions; the losing call is cancelled.
+    """
+
+    async def _timed(self, func, *args):
+        started = time.monotonic()
+        result = await func(*args)
+        if func is self.primary:
+            self.tracker.add(time.monotonic() - started)
+        return result
+
+    async def __call__(self, *args):
+        primary = asyncio.ensure_future(self._timed(self.primary, *args))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=hedge_delay(self.tracker))
+            if done and primary.exception() is None:
+                return primary.result()
+
+            logger.info(f"{self.__name__}: primary slow or failed, asking secondary")
+            pending.add(asyncio.ensure_future(self._timed(self.secondary, *args)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
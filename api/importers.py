@@ -0,0 +1,242 @@
+import logging
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from openpyxl import load_workbook
+
+from . import retrieval
+from .cache import bump_version
+from .models import AiData, Category, CategoryStats
+
+logger = logging.getLogger("daryo-api")
+
+# Error of a row upsert_articles could not store
+LINK_CONFLICT = "An article with the same link exists already."
+
+REQUIRED_COLUMNS = ("heading", "content", "category")
+
+
+class ImportFormatError(ValueError):
+    """The workbook cannot be imported at all (e.g. a required column is missing)."""
+
+
+@dataclass
+class ImportResult:
+    rows: int = 0
+    created: int = 0
+    duplicates: int = 0  # rows whose article already exists; their categories are merged
+    categories_created: int = 0
+    errors: list = field(default_factory=list)  # (row number, message)
+
+
+def read_rows(file, chunk_size):
+    """
+    Stream the first sheet of an .xlsx workbook in read-only mode and yield
+    lists of up to `chunk_size` (row number, {column: value}) pairs.
+    """
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None) or ()
+        columns = [str(name).strip() if name is not None else "" for name in header]
+        missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+        if missing:
+            raise ImportFormatError(
+                "The Excel file must contain 'heading', 'content', and 'category' columns."
+            )
+
+        chunk = []
+        for number, values in enumerate(rows, start=2):
+            if not any(value is not None for value in values):
+                continue  # blank line
+            chunk.append((number, dict(zip(columns, values))))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        workbook.close()
+
+
+def clean_row(row):
+    """
+    Return (heading, content, category names) of a row, or raise ValueError.
+    """
+    heading = str(row.get("heading") or "").strip()
+    content = str(row.get("content") or "").strip()
+    if not heading:
+        raise ValueError("heading is empty")
+    if not content:
+        raise ValueError("content is empty")
+
+    names = [name.strip() for name in str(row.get("category") or "").split(",")]
+    names = [name for name in names if name]
+    if not names:
+        raise ValueError("category is empty")
+    for name in names:
+        if len(name) > Category._meta.get_field("name").max_length:
+            raise ValueError(f"category name is too long: {name[:30]}...")
+    return heading, content, names
+
+
+def resolve_categories(names, category_ids):
+    """
+    Add the ids of `names` to `category_ids`, creating the categories that
+    do not exist yet with one bulk insert. Returns the number created.
+    """
+    names = set(names) - category_ids.keys()
+    if not names:
+        return 0
+    category_ids.update(
+        Category.objects.filter(name__in=names).values_list("name", "id")
+    )
+    missing = names - category_ids.keys()
+    if missing:
+        Category.objects.bulk_create(
+            [Category(name=name) for name in missing], ignore_conflicts=True
+        )
+        category_ids.update(
+            Category.objects.filter(name__in=missing).values_list("name", "id")
+        )
+    return len(missing)
+
+
+def upsert_articles(rows, batch_size=1000):
+    """
+    Insert the (unsaved AiData, category ids) rows whose content hash is new
+    with bulk inserts; a row whose article already exists, in the table or
+    earlier in `rows`, only adds its categories to that article. Returns an
+    (article id, created) pair for every row; the id is None for a new
+    article that was not stored because another article has its feed link.
+    Bulk inserts send no signals: once the data is committed, call
+    catalog_changed() with the created ids.
+    """
+    for article, _ in rows:
+        article.update_token_counts()
+        article.update_content_hash()
+
+    # One index probe for the whole batch
+    ids = dict(
+        AiData.objects.filter(
+            content_hash__in={article.content_hash for article, _ in rows}
+        ).values_list("content_hash", "id")
+    )
+    new = {}
+    for article, _ in rows:
+        if article.content_hash not in ids:
+            new.setdefault(article.content_hash, article)
+    if new:
+        # A concurrent upload may insert the same article meanwhile
+        AiData.objects.bulk_create(
+            new.values(), batch_size=batch_size, ignore_conflicts=True
+        )
+        ids.update(
+            AiData.objects.filter(content_hash__in=new.keys()).values_list(
+                "content_hash", "id"
+            )
+        )
+        # Rows skipped for another unique column, i.e. the feed link, have no
+        # id; the caller reports them and the rest of the batch is kept
+
+    stored = [row for row in rows if row[0].content_hash in ids]
+    link_categories(
+        [(ids[article.content_hash], category_ids) for article, category_ids in stored],
+        batch_size,
+    )
+    CategoryStats.refresh(
+        {category_id for _, category_ids in stored for category_id in category_ids}
+    )
+    return [
+        (
+            ids.get(article.content_hash),
+            article.content_hash in ids and new.get(article.content_hash) is article,
+        )
+        for article, _ in rows
+    ]
+
+
+def link_categories(rows, batch_size=1000):
+    """
+    Add the category links of (article id, category ids) rows with one bulk
+    insert; links that exist already are left alone.
+    """
+    Through = AiData.categories.through
+    Through.objects.bulk_create(
+        [
+            Through(aidata_id=article_id, category_id=category_id)
+            for article_id, category_ids in rows
+            for category_id in set(category_ids)
+        ],
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+
+
+def catalog_changed(article_ids=None):
+    """
+    Drop cached catalog strings after a bulk write. `article_ids` are the
+    articles whose text was written, for the retrieval indexes to update;
+    with None they are rebuilt, with none (only categories changed) they are
+    left alone.
+    """
+    bump_version("catalog")
+    if article_ids is None or article_ids:
+        retrieval.articles_changed(article_ids)
+
+
+def import_articles(file, batch_size=1000, progress=None):
+    """
+    Import articles from an .xlsx workbook with 'heading', 'content' and
+    'category' (comma separated names) columns. Rows are read in chunks and
+    written with bulk inserts in one transaction; invalid rows are skipped
+    and reported in the result. `progress(result)` is called after every
+    chunk with the counts so far.
+    """
+    result = ImportResult()
+    category_ids = {}
+    created_ids = []
+
+    with transaction.atomic():
+        for chunk in read_rows(file, batch_size):
+            result.rows += len(chunk)
+
+            cleaned = []
+            for number, row in chunk:
+                try:
+                    cleaned.append((number, *clean_row(row)))
+                except ValueError as e:
+                    result.errors.append((number, str(e)))
+
+            names = [name for *_, row_names in cleaned for name in row_names]
+            result.categories_created += resolve_categories(names, category_ids)
+
+            upserted = upsert_articles(
+                [
+                    (
+                        AiData(heading=heading, content=content),
+                        [category_ids[name] for name in row_names],
+                    )
+                    for _, heading, content, row_names in cleaned
+                ],
+                batch_size,
+            )
+            for (number, *_), (article_id, created) in zip(cleaned, upserted):
+                if article_id is None:
+                    result.errors.append((number, LINK_CONFLICT))
+                elif created:
+                    result.created += 1
+                    created_ids.append(article_id)
+                else:
+                    result.duplicates += 1
+
+            if progress is not None:
+                progress(result)
+
+        transaction.on_commit(lambda: catalog_changed(created_ids))
+
+    logger.info(
+        f"Imported {result.created} of {result.rows} articles, "
+        f"{result.duplicates} duplicates, {len(result.errors)} errors"
+    )
+    return result
@@ -0,0 +1,163 @@
+import asyncio
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client as TestClient, override_settings
+
+from api import utils
+from api.models import APIKey, Client, DailyUsageRollup, UsageLimit
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the WSGI conversation endpoint (a fixed pool of blocking workers) "
+        "with the async one (a single event loop) using fake AI providers that "
+        "sleep for --latency seconds per call."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of blocking workers serving the WSGI path.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=200,
+            help="Requests in flight at once on the async path.",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.5,
+            help="Seconds each fake provider call takes.",
+        )
+
+    def handle(self, *args, **options):
+        latency = options["latency"]
+        self.install_fake_providers(latency)
+
+        run_id = uuid.uuid4().hex[:8]
+        api_key = APIKey.objects.create(request_count=10**9)
+        created_limits = [
+            UsageLimit.objects.get_or_create(
+                is_muhbir=is_muhbir, defaults={"daily_limit": 10**6}
+            )
+            for is_muhbir in (False, True)
+        ]
+        headers = {"X-API-KEY": str(api_key.key)}
+
+        try:
+            # The test clients send requests as "testserver"
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+                results = [
+                    ("wsgi", *self.run_wsgi(run_id, headers, options)),
+                    ("asgi", *self.run_asgi(run_id, headers, options)),
+                ]
+        finally:
+            Client.objects.filter(external_id__startswith=f"benchmark-{run_id}").delete()
+            DailyUsageRollup.objects.filter(api_key=api_key).delete()
+            for usage_limit, created in created_limits:
+                if created:
+                    usage_limit.delete()
+            api_key.delete()
+
+        self.stdout.write(
+            f"{options['requests']} requests, {latency}s per provider call "
+            f"(up to 3 calls per request), {options['workers']} WSGI workers, "
+            f"async concurrency {options['concurrency']}"
+        )
+        self.stdout.write(
+            f"{'mode':<6}{'ok':>6}{'wall s':>10}{'req/s':>10}{'p50 s':>10}{'p95 s':>10}"
+        )
+        for mode, ok, wall, latencies in results:
+            p50, p95 = self.percentiles(latencies)
+            self.stdout.write(
+                f"{mode:<6}{ok:>6}{wall:>10.2f}{ok / wall:>10.2f}{p50:>10.2f}{p95:>10.2f}"
+            )
+
+    def install_fake_providers(self, latency):
+        def fake_get_id(content, user_message):
+            time.sleep(latency)
+            return "0"
+
+        def fake_ai(content, user_message):
+            time.sleep(latency)
+            return "benchmark answer"
+
+        async def fake_get_id_async(content, user_message):
+            await asyncio.sleep(latency)
+            return "0"
+
+        async def fake_ai_async(content, user_message):
+            await asyncio.sleep(latency)
+            return "benchmark answer"
+
+        utils.get_id = fake_get_id
+        utils.ai = fake_ai
+        utils.get_id_async = fake_get_id_async
+        utils.ai_async = fake_ai_async
+
+    def payload(self, run_id, mode, index):
+        return {
+            "external_id": f"benchmark-{run_id}-{mode}-{index}",
+            "name": "benchmark",
+            # A different question per request, so answers are never served
+            # from the answer cache and every request takes the provider path
+            "message": f"What is the latest news? (benchmark {mode} {index})",
+        }
+
+    def run_wsgi(self, run_id, headers, options):
+        def send(index):
+            started = time.perf_counter()
+            response = TestClient().post(
+                "/daryo-api/api/v1/ai/conversation/",
+                self.payload(run_id, "wsgi", index),
+                content_type="application/json",
+                headers=headers,
+            )
+            return response.status_code, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            responses = list(pool.map(send, range(options["requests"])))
+        return self.summarize(responses, time.perf_counter() - started)
+
+    def run_asgi(self, run_id, headers, options):
+        async def main():
+            client = AsyncClient()
+            semaphore = asyncio.Semaphore(options["concurrency"])
+
+            async def send(index):
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.post(
+                        "/daryo-api/api/v1/ai/conversation/async/",
+                        self.payload(run_id, "asgi", index),
+                        content_type="application/json",
+                        headers=headers,
+                    )
+                    return response.status_code, time.perf_counter() - started
+
+            return await asyncio.gather(*(send(i) for i in range(options["requests"])))
+
+        started = time.perf_counter()
+        responses = asyncio.run(main())
+        return self.summarize(responses, time.perf_counter() - started)
+
+    def summarize(self, responses, wall):
+        ok = sum(1 for status_code, _ in responses if status_code == 200)
+        return ok, wall, [elapsed for _, elapsed in responses]
+
+    def percentiles(self, values):
+        if len(values) < 2:
+            return (values[0], values[0]) if values else (0.0, 0.0)
+        cuts = statistics.quantiles(values, n=20)
+        return statistics.median(values), cuts[18]
@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.cache import get_version
+from api.models import AiData
+from api.retrieval import VectorIndex, get_embedder
+
+
+class Command(BaseCommand):
+    help = "Embed all AiData articles and save the vector index to VECTOR_INDEX_DIR."
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        index = VectorIndex(get_embedder())
+        # Saved with the articles version, so workers bring it up to date
+        version = get_version("articles")
+        index.build(
+            AiData.objects.values_list("id", "heading", "content").iterator(), version
+        )
+        index.save(settings.VECTOR_INDEX_DIR)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Indexed {len(index)} articles with {index.embedder.name} "
+                f"in {time.perf_counter() - started:.2f}s"
+            )
+        )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importers import ImportFormatError, import_articles
+
+
+class Command(BaseCommand):
+    help = "Import AiData articles from an .xlsx workbook (heading, content, category)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Path of the .xlsx file")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        def progress(result):
+            self.stdout.write(
+                f"{result.rows} rows read, {result.created} imported, "
+                f"{result.duplicates} duplicates, {len(result.errors)} skipped"
+            )
+
+        try:
+            result = import_articles(
+                options["path"], batch_size=options["batch_size"], progress=progress
+            )
+        except (ImportFormatError, OSError) as e:
+            raise CommandError(str(e))
+
+        for number, error in result.errors:
+            self.stderr.write(f"Row {number} skipped: {error}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {result.created} of {result.rows} rows, "
+                f"{result.duplicates} already existed, "
+                f"{result.categories_created} new categories"
+            )
+        )
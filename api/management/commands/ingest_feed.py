@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.feeds import ingest_feed, open_source
+
+
+class Command(BaseCommand):
+    help = (
+        "Ingest a Daryo feed dump (see text.txt) from a file or URL into AiData, "
+        "deduplicated by link; only items newer than the last run are processed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="File path or http(s)/file URL of the feed")
+        parser.add_argument(
+            "--name", default="daryo", help="Feed name the high-water mark is kept under"
+        )
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Process every item, ignoring the high-water mark",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            stream = open_source(options["source"])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot open {options['source']}: {e}")
+
+        with stream:
+            result = ingest_feed(
+                stream,
+                name=options["name"],
+                batch_size=options["batch_size"],
+                full=options["full"],
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{result.items} items: {result.created} created, "
+                f"{result.updated} updated, {result.unchanged} unchanged, "
+                f"{result.skipped} older than the last run, "
+                f"{result.errors} failed; "
+                f"{result.categories_created} new categories; "
+                f"high-water mark {result.high_water}"
+            )
+        )
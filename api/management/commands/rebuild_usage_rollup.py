@@ -0,0 +1,25 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import DailyUsageRollup
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily usage rollup from all messages, or from --since on."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since", help="First day to rebuild, YYYY-MM-DD (default: all days)"
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            try:
+                since = date.fromisoformat(options["since"])
+            except ValueError:
+                raise CommandError("--since must be a date in YYYY-MM-DD format")
+
+        rows = DailyUsageRollup.rebuild(since)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} usage rollup rows"))
@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.cache import bump_version
+from api.models import AiData, CategoryStats, Conversation, DailyUsageRollup, Message
+from api.tokenizer import count_tokens
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the stored token counts of articles, messages and conversation "
+        "histories with the configured TOKENIZER, then the category stats and the "
+        "usage rollup. Run it after changing TOKENIZER. Prompt tokens recorded "
+        "with each answer cannot be recounted and are kept."
+    )
+
+    def handle(self, *args, **options):
+        articles = self.recount(
+            AiData.objects.only("id", "heading", "content"),
+            heading_tokens=lambda article: count_tokens(article.heading),
+            content_tokens=lambda article: count_tokens(article.content),
+        )
+        messages = self.recount(
+            Message.objects.only("id", "content"),
+            tokens=lambda message: count_tokens(message.content),
+        )
+        conversations = self.recount(
+            Conversation.objects.exclude(history=[]).only("id", "history"),
+            history=self.recount_history,
+            history_tokens=lambda conversation: sum(
+                tokens for _, tokens in conversation.history
+            ),
+        )
+
+        CategoryStats.refresh()
+        rollups = DailyUsageRollup.rebuild()
+        # Cached articles and prompt counts carry the old counts
+        AiData.changed(AiData.objects.values_list("id", flat=True).iterator())
+        bump_version("catalog")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Recounted {articles} articles, {messages} messages and "
+                f"{conversations} conversation histories with {settings.TOKENIZER}, "
+                f"wrote {rollups} usage rollup rows"
+            )
+        )
+
+    @staticmethod
+    def recount_history(conversation):
+        history = [[text, count_tokens(text)] for text, _ in conversation.history]
+        total_tokens = sum(tokens for _, tokens in history)
+        while history and total_tokens > Conversation.HISTORY_MAX_TOKENS:
+            total_tokens -= history.pop(0)[1]
+        return history
+
+    @staticmethod
+    def recount(queryset, **fields):
+        """
+        Set each of `fields` to its function of the row, in batches of
+        BATCH_SIZE (in order, since history_tokens reads the new history).
+        Returns the number of rows.
+        """
+        count = 0
+        batch = []
+        for row in queryset.order_by("pk").iterator(chunk_size=BATCH_SIZE):
+            for field, value in fields.items():
+                setattr(row, field, value(row))
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                queryset.model.objects.bulk_update(batch, list(fields))
+                count += len(batch)
+                batch = []
+        if batch:
+            queryset.model.objects.bulk_update(batch, list(fields))
+            count += len(batch)
+        return count
@@ -1,3 +1,5 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
 from django.http import JsonResponse
 from .models import APIKey, UsageLimit
 
@@ -5,39 +7,105 @@ from .models import APIKey, UsageLimit
 class APIKeyMiddleware:
     """
     Middleware to check if the provided API key is valid.
+    Works in both WSGI and ASGI mode, so async views are not pushed into a thread.
     """
 
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
         # Get the API key from the request headers
         if request.path.startswith("/daryo-api/admin"):
             return self.get_response(request)
+
+        error_response = self.authorize(request)
+        if error_response is not None:
+            return error_response
+
+        # Proceed with the request if the API key is valid
+        try:
+            response = self.get_response(request)
+        except Exception:
+            self.release_reservation(request)
+            raise
+        self.release_reservation(request, response)
+        return response
+
+    async def __acall__(self, request):
+        if request.path.startswith("/daryo-api/admin"):
+            return await self.get_response(request)
+
+        error_response = await sync_to_async(self.authorize)(request)
+        if error_response is not None:
+            return error_response
+
+        try:
+            response = await self.get_response(request)
+        except Exception:
+            await sync_to_async(self.release_reservation)(request)
+            raise
+        await sync_to_async(self.release_reservation)(request, response)
+        return response
+
+    def authorize(self, request):
+        """
+        Attach the API key to the request and count the request against it.
+        Returns an error response if the request must be refused, None otherwise.
+        """
         api_key = request.headers.get("X-API-KEY")
 
         if not api_key:
             return JsonResponse({"error": "API key required"}, status=401)
 
-        # Check if the API key is valid and active
-        try:
-            key = APIKey.objects.get(key=api_key, is_active=True)
-        except APIKey.DoesNotExist:
+        # Check if the API key is valid and active (cached, see APIKey.get_active)
+        key = APIKey.get_active(api_key)
+        if key is None:
             return JsonResponse({"error": "Invalid or inactive API key"}, status=403)
 
-        if not key.can_use_requests():
+        if not key.use_request():
             return JsonResponse(
                 {"error": "Requests limit reached, no requests remaining"}, status=403
             )
-        key.request_used += 1
-        key.save()
-        # if not key.can_use_tokens(500):
-
-        #     return JsonResponse(
-        #         {"error": "Token limit reached, no tokens remaining"}, status=403
-        #     )
 
         request.api_key = key
-        # Proceed with the request if the API key is valid
-        response = self.get_response(request)
-        return response
+        return None
+
+    def release_reservation(self, request, response=None):
+        """
+        Give back reservations the view did not settle (errors, failed AI calls).
+        Streaming responses settle their reservation when they are closed, see
+        SettledStream.
+        """
+        if response is not None and response.streaming:
+            return
+        reservation = getattr(request, "token_reservation", None)
+        if reservation is not None:
+            reservation.release()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """
+        Hold an estimated amount of tokens for views that call the AI; the view
+        settles the reservation to the real usage once it knows it.
+        """
+        view_class = getattr(view_func, "view_class", None)
+        methods = getattr(view_class, "token_reservation_methods", ())
+        if request.method not in methods or not hasattr(request, "api_key"):
+            return None
+
+        reservation = request.api_key.reserve_tokens(
+            settings.TOKEN_RESERVATION_ESTIMATE
+        )
+        if reservation is None:
+            return JsonResponse(
+                {"error": "Token limit reached, no tokens remaining"}, status=403
+            )
+        request.token_reservation = reservation
+        return None
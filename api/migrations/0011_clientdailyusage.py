@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-17 10:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def backfill_daily_usage(apps, schema_editor):
+    Message = apps.get_model("api", "Message")
+    ClientDailyUsage = apps.get_model("api", "ClientDailyUsage")
+
+    rows = (
+        Message.objects.filter(sender="client")
+        .annotate(date=TruncDate("timestamp"))
+        .values("conversation__client_id", "date")
+        .annotate(message_count=Count("id"))
+        .order_by()
+    )
+    ClientDailyUsage.objects.bulk_create(
+        (
+            ClientDailyUsage(
+                client_id=row["conversation__client_id"],
+                date=row["date"],
+                message_count=row["message_count"],
+            )
+            for row in rows.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_apikey_request_count_apikey_request_used'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientDailyUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_usage', to='api.client')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('client', 'date'), name='unique_daily_usage_per_client')],
+            },
+        ),
+        migrations.RunPython(backfill_daily_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 10:06
+
+from django.db import migrations, models
+
+
+def seed_clients_counter(apps, schema_editor):
+    Client = apps.get_model("api", "Client")
+    Counter = apps.get_model("api", "Counter")
+    Counter.objects.update_or_create(
+        name="clients", defaults={"value": Client.objects.count()}
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_clientdailyusage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Counter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_clients_counter, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-17 10:18
+
+import math
+import re
+
+from django.db import migrations, models
+
+# Same as api.tokenizer.count_tokens (RegexTokenizer) at the time of this migration;
+# run the recount_tokens command when another TOKENIZER is configured
+PIECE_RE = re.compile(r"[^\W\d_]+|\d{1,3}|[^\w\s]|_", re.UNICODE)
+
+
+def count_tokens(text):
+    tokens = 0
+    for piece in PIECE_RE.findall(text or ""):
+        if piece.isascii():
+            tokens += math.ceil(len(piece) / 5) if piece[0].isalpha() else 1
+        elif piece[0].isalpha():
+            tokens += math.ceil(len(piece) / 3)
+        else:
+            tokens += max(1, len(piece.encode("utf-8")) // 2)
+    return tokens
+
+
+def count_article_tokens(apps, schema_editor):
+    AiData = apps.get_model("api", "AiData")
+
+    batch = []
+    for article in AiData.objects.only("id", "heading", "content").iterator(
+        chunk_size=1000
+    ):
+        article.heading_tokens = count_tokens(article.heading)
+        article.content_tokens = count_tokens(article.content)
+        batch.append(article)
+        if len(batch) >= 1000:
+            AiData.objects.bulk_update(batch, ["heading_tokens", "content_tokens"])
+            batch = []
+    if batch:
+        AiData.objects.bulk_update(batch, ["heading_tokens", "content_tokens"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aidata',
+            name='content_tokens',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='aidata',
+            name='heading_tokens',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_article_tokens, migrations.RunPython.noop),
+    ]
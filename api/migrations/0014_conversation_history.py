@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-17 10:19
+
+import math
+import re
+
+from django.db import migrations, models
+
+# Same as api.tokenizer.count_tokens (RegexTokenizer) at the time of this migration;
+# run the recount_tokens command when another TOKENIZER is configured
+PIECE_RE = re.compile(r"[^\W\d_]+|\d{1,3}|[^\w\s]|_", re.UNICODE)
+
+
+def count_tokens(text):
+    tokens = 0
+    for piece in PIECE_RE.findall(text or ""):
+        if piece.isascii():
+            tokens += math.ceil(len(piece) / 5) if piece[0].isalpha() else 1
+        elif piece[0].isalpha():
+            tokens += math.ceil(len(piece) / 3)
+        else:
+            tokens += max(1, len(piece.encode("utf-8")) // 2)
+    return tokens
+
+
+HISTORY_MAX_TOKENS = 6000
+
+
+def fill_history(apps, schema_editor):
+    Conversation = apps.get_model("api", "Conversation")
+    Message = apps.get_model("api", "Message")
+
+    for conversation in Conversation.objects.exclude(last_refreshed=None).iterator():
+        messages = Message.objects.filter(
+            conversation=conversation, timestamp__gte=conversation.last_refreshed
+        ).order_by("-timestamp")
+
+        history = []
+        total_tokens = 0
+        for message in messages.iterator():
+            timestamp = message.timestamp.strftime("%Y-%m-%d %H:%M:%S")
+            sender = "User" if message.sender == "client" else "AI"
+            text = f"{timestamp} - {sender}: {message.content}"
+            tokens = count_tokens(text)
+            if total_tokens + tokens > HISTORY_MAX_TOKENS:
+                break
+            history.append([text, tokens])
+            total_tokens += tokens
+
+        history.reverse()
+        conversation.history = history
+        conversation.history_tokens = total_tokens
+        conversation.save(update_fields=["history", "history_tokens"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_aidata_token_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='history',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='history_tokens',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_history, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_conversation_history'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'timestamp', 'id'], name='message_conversation_keyset'),
+        ),
+    ]
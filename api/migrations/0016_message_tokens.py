@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 10:21
+
+import math
+import re
+
+from django.db import migrations, models
+
+# Same as api.tokenizer.count_tokens (RegexTokenizer) at the time of this migration;
+# run the recount_tokens command when another TOKENIZER is configured
+PIECE_RE = re.compile(r"[^\W\d_]+|\d{1,3}|[^\w\s]|_", re.UNICODE)
+
+
+def count_tokens(text):
+    tokens = 0
+    for piece in PIECE_RE.findall(text or ""):
+        if piece.isascii():
+            tokens += math.ceil(len(piece) / 5) if piece[0].isalpha() else 1
+        elif piece[0].isalpha():
+            tokens += math.ceil(len(piece) / 3)
+        else:
+            tokens += max(1, len(piece.encode("utf-8")) // 2)
+    return tokens
+
+
+def count_message_tokens(apps, schema_editor):
+    Message = apps.get_model("api", "Message")
+
+    batch = []
+    for message in Message.objects.only("id", "content").iterator(chunk_size=1000):
+        message.tokens = count_tokens(message.content)
+        batch.append(message)
+        if len(batch) >= 1000:
+            Message.objects.bulk_update(batch, ["tokens"])
+            batch = []
+    if batch:
+        Message.objects.bulk_update(batch, ["tokens"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_message_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='tokens',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_message_tokens, migrations.RunPython.noop),
+    ]
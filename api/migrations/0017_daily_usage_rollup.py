@@ -0,0 +1,96 @@
+# Generated by Django 5.2.18 on 2026-10-17 10:23
+
+import django.db.models.deletion
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def fill_rollup(apps, schema_editor):
+    Message = apps.get_model("api", "Message")
+    DailyUsageRollup = apps.get_model("api", "DailyUsageRollup")
+
+    input_price = Decimal(str(settings.INPUT_TOKEN_PRICE))
+    output_price = Decimal(str(settings.OUTPUT_TOKEN_PRICE))
+    groups = (
+        Message.objects.annotate(date=TruncDate("timestamp"))
+        .values("date", "conversation__client__is_muhbir", "sender")
+        .annotate(
+            message_count=Count("id"),
+            input_tokens=Sum("input_tokens"),
+            content_tokens=Sum("tokens"),
+        )
+        .order_by()
+    )
+
+    def usage(sender, message_count, input_tokens, content_tokens):
+        # Frozen copy of DailyUsageRollup.usage as of this migration
+        if sender != "ai":
+            return 0, 0, Decimal(0)
+        output_tokens = content_tokens + 5 * message_count
+        cost = (
+            Decimal(input_tokens) * input_price + Decimal(output_tokens) * output_price
+        ) / 1_000_000
+        return input_tokens, output_tokens, cost.quantize(Decimal("0.000001"))
+
+    def rows():
+        for group in groups.iterator():
+            # Earlier messages have no key recorded
+            input_tokens, output_tokens, cost = usage(
+                group["sender"],
+                group["message_count"],
+                group["input_tokens"] or 0,
+                group["content_tokens"] or 0,
+            )
+            yield DailyUsageRollup(
+                date=group["date"],
+                is_muhbir=group["conversation__client__is_muhbir"],
+                sender=group["sender"],
+                message_count=group["message_count"],
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                cost=cost,
+            )
+
+    DailyUsageRollup.objects.bulk_create(rows(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_message_tokens'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='api_key',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='api.apikey'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='input_tokens',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='DailyUsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('is_muhbir', models.BooleanField()),
+                ('sender', models.CharField(choices=[('client', 'Client'), ('ai', 'AI')], max_length=6)),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('input_tokens', models.PositiveBigIntegerField(default=0)),
+                ('output_tokens', models.PositiveBigIntegerField(default=0)),
+                ('cost', models.DecimalField(decimal_places=6, default=0, max_digits=16)),
+                ('api_key', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='api.apikey')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('api_key__isnull', False)), fields=('date', 'is_muhbir', 'api_key', 'sender'), name='unique_usage_rollup'), models.UniqueConstraint(condition=models.Q(('api_key__isnull', True)), fields=('date', 'is_muhbir', 'sender'), name='unique_usage_rollup_without_key')],
+            },
+        ),
+        migrations.RunPython(fill_rollup, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 10:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_daily_usage_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('high_water', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='aidata',
+            name='link',
+            field=models.URLField(blank=True, default='', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='aidata',
+            name='link_hash',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True, unique=True),
+        ),
+    ]
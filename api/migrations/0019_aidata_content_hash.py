@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-17 10:31
+
+import hashlib
+import unicodedata
+
+from django.db import migrations, models
+
+
+def hash_content(heading, content):
+    # Same as AiData.hash_content at the time of this migration
+    text = "\n".join(
+        " ".join(unicodedata.normalize("NFKC", part).casefold().split())
+        for part in (heading, content)
+    )
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def hash_articles(apps, schema_editor):
+    """
+    Hash every article; of duplicates stored before, only the oldest gets
+    the hash, the copies keep NULL.
+    """
+    AiData = apps.get_model("api", "AiData")
+
+    seen = set()
+    batch = []
+    for article in (
+        AiData.objects.only("id", "heading", "content")
+        .order_by("id")
+        .iterator(chunk_size=1000)
+    ):
+        content_hash = hash_content(article.heading, article.content)
+        if content_hash in seen:
+            continue
+        seen.add(content_hash)
+        article.content_hash = content_hash
+        batch.append(article)
+        if len(batch) >= 1000:
+            AiData.objects.bulk_update(batch, ["content_hash"])
+            batch = []
+    if batch:
+        AiData.objects.bulk_update(batch, ["content_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_feed_ingestion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aidata',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True, unique=True),
+        ),
+        migrations.RunPython(hash_articles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-17 10:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def count_categories(apps, schema_editor):
+    AiData = apps.get_model("api", "AiData")
+    Category = apps.get_model("api", "Category")
+    CategoryStats = apps.get_model("api", "CategoryStats")
+
+    totals = {
+        row["category_id"]: row
+        for row in AiData.categories.through.objects.values("category_id")
+        .annotate(
+            article_count=models.Count("aidata_id"),
+            heading_tokens=models.Sum("aidata__heading_tokens"),
+            content_tokens=models.Sum("aidata__content_tokens"),
+        )
+        .order_by()
+    }
+    stats = []
+    for category_id in Category.objects.values_list("id", flat=True):
+        row = totals.get(category_id, {})
+        stats.append(
+            CategoryStats(
+                category_id=category_id,
+                article_count=row.get("article_count", 0),
+                heading_tokens=row.get("heading_tokens") or 0,
+                content_tokens=row.get("content_tokens") or 0,
+            )
+        )
+    CategoryStats.objects.bulk_create(stats, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_aidata_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryStats',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='api.category')),
+                ('article_count', models.PositiveIntegerField(default=0)),
+                ('heading_tokens', models.PositiveBigIntegerField(default=0)),
+                ('content_tokens', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'category stats',
+            },
+        ),
+        migrations.RunPython(count_categories, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 5.2.18 on 2026-10-17 11:02
+
+import hashlib
+import unicodedata
+
+from django.db import migrations, models
+
+
+def hash_content(heading, content):
+    # Same as AiData.hash_content at the time of this migration
+    text = "\n".join(
+        " ".join(unicodedata.normalize("NFKC", part).casefold().split())
+        for part in (heading, content)
+    )
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    Merge the duplicate articles 0019 left without a hash into the article
+    that has it: their categories (and the feed link, if the survivor has
+    none) move to it and the copies are deleted. Saving such a copy would
+    otherwise fail on the unique hash.
+    """
+    AiData = apps.get_model("api", "AiData")
+    Category = apps.get_model("api", "Category")
+    CategoryStats = apps.get_model("api", "CategoryStats")
+    Through = AiData.categories.through
+
+    duplicates = list(
+        AiData.objects.filter(content_hash=None)
+        .only("id", "heading", "content", "link", "link_hash")
+        .order_by("id")
+    )
+    if not duplicates:
+        return
+
+    hashes = {
+        article.id: hash_content(article.heading, article.content)
+        for article in duplicates
+    }
+    survivors = dict(
+        AiData.objects.filter(content_hash__in=set(hashes.values())).values_list(
+            "content_hash", "id"
+        )
+    )
+    for article in duplicates:
+        content_hash = hashes[article.id]
+        survivor_id = survivors.get(content_hash)
+        if survivor_id is None:
+            # The article it duplicated is gone, this one takes its place
+            article.content_hash = content_hash
+            article.save(update_fields=["content_hash"])
+            survivors[content_hash] = article.id
+            continue
+
+        Through.objects.bulk_create(
+            [
+                Through(aidata_id=survivor_id, category_id=category_id)
+                for category_id in Through.objects.filter(
+                    aidata_id=article.id
+                ).values_list("category_id", flat=True)
+            ],
+            ignore_conflicts=True,
+        )
+        article.delete()
+        if article.link_hash:
+            AiData.objects.filter(id=survivor_id, link_hash=None).update(
+                link=article.link, link_hash=article.link_hash
+            )
+
+    # Recount the categories, as 0020 does
+    totals = {
+        row["category_id"]: row
+        for row in Through.objects.values("category_id")
+        .annotate(
+            article_count=models.Count("aidata_id"),
+            heading_tokens=models.Sum("aidata__heading_tokens"),
+            content_tokens=models.Sum("aidata__content_tokens"),
+        )
+        .order_by()
+    }
+    for category_id in Category.objects.values_list("id", flat=True):
+        row = totals.get(category_id, {})
+        CategoryStats.objects.update_or_create(
+            category_id=category_id,
+            defaults={
+                "article_count": row.get("article_count", 0),
+                "heading_tokens": row.get("heading_tokens") or 0,
+                "content_tokens": row.get("content_tokens") or 0,
+            },
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_category_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 11:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_merge_duplicate_articles'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['timestamp'], name='message_timestamp'),
+        ),
+    ]
@@ -1,11 +1,69 @@
 from django.db import models
 from django.utils import timezone
-from datetime import timedelta
-from django.db import transaction
+from datetime import datetime, timedelta
+from django.db import connection, transaction, IntegrityError
+from django.db.models import F
+from decimal import Decimal
 
 from django.db import models
+import hashlib
+import unicodedata
 import uuid
 from django.utils import timezone
+from django.conf import settings
+
+from .cache import (
+    MISSING,
+    LRUCache,
+    bump_version,
+    get_or_load,
+    get_or_load_versioned,
+    get_version,
+)
+from .counters import WriteBehindCounter
+from .tokenizer import count_tokens
+
+
+# Live request usage of every API key, written back to APIKey.request_used in batches
+request_counter = WriteBehindCounter(
+    "api.APIKey",
+    "request_used",
+    flush_interval=settings.REQUEST_COUNTER_FLUSH_INTERVAL,
+    flush_size=settings.REQUEST_COUNTER_FLUSH_SIZE,
+)
+# Live token usage of every API key, written back to APIKey.tokens_used in batches
+tokens_counter = WriteBehindCounter(
+    "api.APIKey",
+    "tokens_used",
+    flush_interval=settings.REQUEST_COUNTER_FLUSH_INTERVAL,
+    flush_size=settings.TOKEN_COUNTER_FLUSH_SIZE,
+)
+
+
+class TokenReservation:
+    """
+    Tokens held against an API key while a request is running. The reserved
+    amount is counted as used straight away and corrected to the real usage
+    by `settle()`, or given back by `release()` if the request used none.
+    """
+
+    def __init__(self, api_key, amount):
+        self.api_key = api_key
+        self.amount = amount
+        self.settled = False
+
+    def settle(self, tokens_used):
+        """
+        Replace the reserved amount with the number of tokens actually used.
+        Only the first call has an effect.
+        """
+        if self.settled:
+            return
+        self.settled = True
+        tokens_counter.incr(self.api_key.pk, tokens_used - self.amount)
+
+    def release(self):
+        self.settle(0)
 
 
 class APIKey(models.Model):
@@ -23,9 +81,27 @@ class APIKey(models.Model):
     request_count = models.PositiveBigIntegerField(default=100000)
     request_used = models.IntegerField(default=0)
 
+    # Fields that are only bumped by usage accounting; saving them alone
+    # does not invalidate the cached key.
+    COUNTER_FIELDS = frozenset({"tokens_used", "request_used"})
+
     def __str__(self):
         return f"API Key {self.key}"
 
+    @classmethod
+    def get_active(cls, key):
+        """
+        Return the active API key matching `key`, or None if there is none.
+        Results are cached for API_KEY_CACHE_TTL seconds and invalidated when
+        the key is saved or deleted.
+        """
+        return get_or_load(
+            "apikey",
+            key,
+            lambda: cls.objects.filter(key=key, is_active=True).first(),
+            settings.API_KEY_CACHE_TTL,
+        )
+
     def save(self, *args, **kwargs):
         if not self.key:
             self.key = str(uuid.uuid4())  # Generate a new API key if one doesn't exist
@@ -33,7 +109,7 @@ class APIKey(models.Model):
 
     def remaining_tokens(self):
         """Returns the number of remaining tokens."""
-        return self.token_limit - self.tokens_used
+        return self.token_limit - tokens_counter.value(self.pk)
 
     def can_use_tokens(self, tokens_requested):
         """
@@ -44,23 +120,42 @@ class APIKey(models.Model):
 
     def can_use_requests(self):
         """
-        Check if the API key has enough remaining tokens to fulfill the request.
+        Check if the API key has requests remaining, including the ones
+        counted but not yet flushed to the database.
         """
 
-        return self.request_count > self.request_used
+        return self.request_count > request_counter.value(self.pk)
 
-    @transaction.atomic
-    def use_tokens(self, tokens_requested):
+    def use_request(self):
         """
-        Deduct the requested tokens from the available tokens if there are enough left,
-        with transaction locking to avoid race conditions.
-        Returns True if tokens were successfully deducted, False otherwise.
+        Count one request against the key if it still has requests remaining.
+        The counter is atomic in the cache and flushed to the database in batches.
+        Returns True if the request was counted, False if the limit is reached.
         """
-        # Lock the row to avoid race conditions
-        api_key = APIKey.objects.select_for_update().get(pk=self.pk)
+        if request_counter.incr(self.pk) > self.request_count:
+            request_counter.incr(self.pk, -1)
+            return False
+        return True
+
+    def reserve_tokens(self, amount):
+        """
+        Hold `amount` tokens for a request that is about to start.
+        Returns a TokenReservation, or None if the key does not have that many
+        tokens left. Keys with a token_limit of 0 have no token budget, their
+        usage is still counted.
+        """
+        used = tokens_counter.incr(self.pk, amount)
+        if self.token_limit > 0 and used > self.token_limit:
+            tokens_counter.incr(self.pk, -amount)
+            return None
+        return TokenReservation(self, amount)
 
-        api_key.tokens_used += tokens_requested
-        api_key.save()
+    def use_tokens(self, tokens_requested):
+        """
+        Add the used tokens to the key. The counter is atomic in the cache and
+        flushed to the database in batches, no row lock is taken.
+        """
+        tokens_counter.incr(self.pk, tokens_requested)
 
 
 class UsageLimit(models.Model):
@@ -78,6 +173,22 @@ class UsageLimit(models.Model):
         client_type = "Muhbir" if self.is_muhbir else "Ordinary Client"
         return f"{client_type}: {self.daily_limit} messages per day"
 
+    @classmethod
+    def get_for(cls, is_muhbir):
+        """
+        Return the usage limit for a client type. Cached for USAGE_LIMIT_CACHE_TTL
+        seconds and invalidated when a limit is saved or deleted.
+        """
+        usage_limit = get_or_load(
+            "usagelimit",
+            bool(is_muhbir),
+            lambda: cls.objects.filter(is_muhbir=is_muhbir).first(),
+            settings.USAGE_LIMIT_CACHE_TTL,
+        )
+        if usage_limit is None:
+            raise cls.DoesNotExist(f"No usage limit for is_muhbir={is_muhbir}")
+        return usage_limit
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -86,12 +197,43 @@ class UsageLimit(models.Model):
         ]
 
 
+class Counter(models.Model):
+    """
+    Named counter kept up to date by the code that changes what it counts,
+    so totals can be read and capped without counting table rows.
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+    @classmethod
+    def increment(cls, name, limit=None):
+        """
+        Add one to the counter. With `limit`, only do so while the value is
+        below it; the check and the increment are one atomic UPDATE.
+        Returns True if the counter was incremented.
+        """
+        counters = cls.objects.filter(name=name)
+        if limit is not None:
+            counters = counters.filter(value__lt=limit)
+        return bool(counters.update(value=F("value") + 1))
+
+    @classmethod
+    def decrement(cls, name):
+        cls.objects.filter(name=name, value__gt=0).update(value=F("value") - 1)
+
+
 class Client(models.Model):
     """
     Model representing a client who is interacting with the AI.
     Includes an external ID for referencing the client from another database.
     """
 
+    COUNTER_NAME = "clients"
+
     is_muhbir = models.BooleanField(default=False)
 
     external_id = models.CharField(
@@ -108,6 +250,81 @@ class Client(models.Model):
     def __str__(self):
         return f"Client: {self.name} (External ID: {self.external_id})"
 
+    @classmethod
+    def get_or_create_within_limit(cls, external_id, defaults):
+        """
+        Like get_or_create, but a new client is only inserted while there are
+        fewer than settings.CLIENTS_COUNT clients. A slot is taken on the
+        "clients" counter in the same transaction, before the insert.
+        Returns (client, created); client is None if the limit is reached.
+        """
+        client = cls.objects.filter(external_id=external_id).first()
+        if client is not None:
+            return client, False
+
+        try:
+            with transaction.atomic():
+                if not Counter.increment(cls.COUNTER_NAME, settings.CLIENTS_COUNT):
+                    return None, False
+                client = cls(external_id=external_id, **defaults)
+                client._counted = True  # already counted, see signals
+                client.save(force_insert=True)
+        except IntegrityError:
+            # Created by a concurrent request; the slot taken above was rolled back
+            client = cls.objects.filter(external_id=external_id).first()
+            if client is None:
+                # Not the external_id conflict, e.g. another constraint
+                raise
+            return client, False
+        return client, True
+
+
+class ClientDailyUsage(models.Model):
+    """
+    Number of messages a client has sent on a given day, incremented whenever
+    a client message is stored so the daily limit check is a single row read.
+    """
+
+    client = models.ForeignKey(
+        Client, on_delete=models.CASCADE, related_name="daily_usage"
+    )
+    date = models.DateField()
+    message_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.client.name}: {self.message_count} messages on {self.date}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["client", "date"], name="unique_daily_usage_per_client"
+            )
+        ]
+
+    @classmethod
+    def increment(cls, client_id, date):
+        """
+        Add one message to the client's counter for `date`, creating the row if needed.
+        """
+        counters = cls.objects.filter(client_id=client_id, date=date)
+        if counters.update(message_count=F("message_count") + 1):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(client_id=client_id, date=date, message_count=1)
+        except IntegrityError:
+            # Another request created the row in the meantime
+            counters.update(message_count=F("message_count") + 1)
+
+    @classmethod
+    def get_count(cls, client_id, date):
+        return (
+            cls.objects.filter(client_id=client_id, date=date)
+            .values_list("message_count", flat=True)
+            .first()
+            or 0
+        )
+
 
 from django.conf import settings
 
@@ -128,6 +345,13 @@ class Conversation(models.Model):
     created_at = models.DateTimeField(
         default=timezone.now
     )  # Timestamp of when the conversation was started
+    # Recent turns of the current window as [formatted message, tokens], oldest
+    # first, appended as messages are written (see append_to_history)
+    history = models.JSONField(default=list, blank=True, editable=False)
+    history_tokens = models.PositiveIntegerField(default=0, editable=False)
+
+    HISTORY_MAX_TOKENS = 6000  # Max tokens allowed in the history
+    HISTORY_WINDOW = timedelta(minutes=30)
 
     def __str__(self):
         return f"Conversation with {self.client.name}"
@@ -140,101 +364,114 @@ class Conversation(models.Model):
     def last_conversation_messages_str(self):
         """
         Return messages from the last refresh time until now. If more than 30 minutes have passed since the
-        last refresh, reset the history and update the refresh time to now, but include the last message from the user.
-        Ensure the message history doesn't exceed 6,000 tokens. Start adding messages from the most recent one.
+        last refresh, only the last message from the user is carried over.
+        The messages come from the history buffer kept up to date by append_to_history,
+        which also starts the new window, so this is a single read of the conversation row.
         """
-
-        def estimate_token_count(text):
-            # Estimate tokens by assuming 1 token for ~4 characters
-            return len(text) // 4
-
-        MAX_TOKENS = 6000  # Max tokens allowed in the history
         now = timezone.now()
 
+        # Re-read the buffer, messages may have been added since this instance was loaded
+        self.history, self.history_tokens, self.last_refreshed = (
+            Conversation.objects.filter(pk=self.pk)
+            .values_list("history", "history_tokens", "last_refreshed")
+            .get()
+        )
+
         # If last_refreshed is not set or more than 30 minutes have passed since last refresh
         if self.last_refreshed is None or (
-            now - self.last_refreshed >= timedelta(minutes=30)
+            now - self.last_refreshed >= self.HISTORY_WINDOW
         ):
-            # Find the last user message (before resetting)
-            last_user_message = (
-                self.messages.filter(sender="client").order_by("-timestamp").first()
+            # Find the last user message
+            last_user_message = next(
+                (text for text, _ in reversed(self.history) if " - User: " in text),
+                None,
             )
-
-            # Update last_refreshed to now (starting a new conversation)
-            self.last_refreshed = now
-            self.save()
-
-            # Return the last user message if it exists
+            if last_user_message is None:
+                message = (
+                    self.messages.filter(sender="client").order_by("-timestamp").first()
+                )
+                if message:
+                    last_user_message = self.format_history_entry(message)
+
+            # Only on this instance: the row is left to append_to_history
+            self.history = []
             if last_user_message:
-                timestamp = last_user_message.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-                formatted_message = f"{timestamp} - User: {last_user_message.content}"
-                return formatted_message
-
-        # Retrieve messages from the most recent to the least recent (descending order)
-        messages = self.messages.filter(timestamp__gte=self.last_refreshed).order_by(
-            "-timestamp"
-        )
-
-        message_list = []
-        total_tokens = 0
-
-        # Loop over the messages from most recent to least recent
-        for message in messages:
-            timestamp = message.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-            sender = "User" if message.sender == "client" else "AI"
-            formatted_message = f"{timestamp} - {sender}: {message.content}"
-
-            # Estimate the number of tokens for this message
-            message_tokens = estimate_token_count(formatted_message)
+                self.history = [[last_user_message, count_tokens(last_user_message)]]
+            self.history_tokens = sum(tokens for _, tokens in self.history)
 
-            # Check if adding this message would exceed the token limit
-            if total_tokens + message_tokens > MAX_TOKENS:
-                # If adding this message exceeds the limit, stop adding more messages
-                break
+        return "\n".join(text for text, _ in self.history)
 
-            # Add the message to the start of the list and update the total token count
-            message_list.insert(
-                0, formatted_message
-            )  # Insert messages at the beginning (reverse order)
-            total_tokens += message_tokens
+    @staticmethod
+    def format_history_entry(message):
+        timestamp = message.timestamp.strftime("%Y-%m-%d %H:%M:%S")
+        sender = "User" if message.sender == "client" else "AI"
+        return f"{timestamp} - {sender}: {message.content}"
 
-        # Join the message list into a single string
-        return "\n".join(message_list)
+    @classmethod
+    def append_to_history(cls, conversation_id, message):
+        """
+        Add a new message to the history buffer of its conversation, dropping
+        the oldest turns once the buffer exceeds HISTORY_MAX_TOKENS. A user
+        message sent HISTORY_WINDOW after the window started starts a new one.
+        """
+        text = cls.format_history_entry(message)
+        tokens = count_tokens(text)
+
+        with transaction.atomic():
+            conversation = (
+                cls.objects.select_for_update()
+                .only("history", "history_tokens", "last_refreshed")
+                .get(pk=conversation_id)
+            )
+            if message.sender == "client" and (
+                conversation.last_refreshed is None
+                or message.timestamp - conversation.last_refreshed
+                >= cls.HISTORY_WINDOW
+            ):
+                conversation.last_refreshed = message.timestamp
+                conversation.history = []
+                conversation.history_tokens = 0
+            elif (
+                conversation.last_refreshed is not None
+                and message.timestamp < conversation.last_refreshed
+            ):
+                return  # belongs to a window that is already closed
+
+            history = conversation.history + [[text, tokens]]
+            total_tokens = conversation.history_tokens + tokens
+            while history and total_tokens > cls.HISTORY_MAX_TOKENS:
+                total_tokens -= history.pop(0)[1]
+
+            conversation.history = history
+            conversation.history_tokens = total_tokens
+            conversation.save(
+                update_fields=["history", "history_tokens", "last_refreshed"]
+            )
 
     @classmethod
     def get_avarage_token_size_for_history(cls):
-        convers = cls.objects.all()
-        count = convers.count()
-
-        total_length = (
-            sum([len(con.last_conversation_messages_str) for con in convers]) // count
-            if count != 0
-            else 0
-        )
+        average = cls.objects.aggregate(average=models.Avg("history_tokens"))["average"]
+        return int(average or 0)
 
-        return total_length // 4
+    def history_turns(self):
+        """
+        Number of messages in the current conversation window, the message
+        just sent included. Call it after last_conversation_messages_str,
+        which re-reads the history buffer.
+        """
+        return len(self.history)
 
     def daily_usage(self):
         """
         Get the number of messages sent by the client today.
         """
-        today_start = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_end = today_start + timedelta(days=1)
-
-        return self.messages.filter(
-            sender="client", timestamp__range=(today_start, today_end)
-        ).count()
+        return ClientDailyUsage.get_count(self.client_id, timezone.localdate())
 
     def can_send_message(self):
         """
         Check if the client can still send messages today based on their usage limit.
         """
-        if self.client.is_muhbir:
-            # Fetch the usage limit for Muhbirs
-            usage_limit = UsageLimit.objects.get(is_muhbir=True).daily_limit
-        else:
-            # Fetch the usage limit for ordinary clients
-            usage_limit = UsageLimit.objects.get(is_muhbir=False).daily_limit
+        usage_limit = UsageLimit.get_for(self.client.is_muhbir).daily_limit
 
         return self.daily_usage() < usage_limit
 
@@ -269,12 +506,241 @@ class Message(models.Model):
     sender = models.CharField(max_length=6, choices=ROLE_CHOICES)  # 'client' or 'ai'
     content = models.TextField()  # The actual message content
     timestamp = models.DateTimeField(default=timezone.now)  # When the message was sent
+    # Tokens of the content, counted on save so usage totals are database sums
+    tokens = models.PositiveIntegerField(default=0, editable=False)
+    # Key the message was sent or answered with; the id is kept if the key is
+    # deleted, so usage history stays intact
+    api_key = models.ForeignKey(
+        APIKey,
+        null=True,
+        blank=True,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="+",
+    )
+    # Prompt tokens sent to the AI for an answer (AI messages only)
+    input_tokens = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return f"Message from {self.sender} at {self.timestamp}"
 
+    def client_is_muhbir(self):
+        """
+        Whether the message is in a Muhbir's conversation. Uses the
+        conversation and client the caller loaded, or reads them in one
+        query and keeps them for the other post_save receivers.
+        """
+        if not Message.conversation.is_cached(self):
+            self.conversation = Conversation.objects.select_related("client").get(
+                pk=self.conversation_id
+            )
+        return self.conversation.client.is_muhbir
+
+    def save(self, *args, **kwargs):
+        self.tokens = count_tokens(self.content)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "content" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "tokens"}
+        # The row and its rollup update (post_save) commit together, see
+        # DailyUsageRollup.rebuild
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     class Meta:
         ordering = ["timestamp"]  # Messages ordered by time
+        indexes = [
+            # Pages of a conversation are read by (timestamp, id), see ClientConversationView.get
+            models.Index(
+                fields=["conversation", "timestamp", "id"],
+                name="message_conversation_keyset",
+            ),
+            # The usage rollup is rebuilt a day at a time, see DailyUsageRollup.rebuild
+            models.Index(fields=["timestamp"], name="message_timestamp"),
+        ]
+
+
+class DailyUsageRollup(models.Model):
+    """
+    Messages, tokens and cost per day, client type, API key and sender. Rows
+    are updated as messages are written (see signals) and can be rebuilt
+    from Message with the rebuild_usage_rollup command, so reports read one
+    row per day instead of every message.
+    """
+
+    date = models.DateField()
+    is_muhbir = models.BooleanField()
+    api_key = models.ForeignKey(
+        APIKey,
+        null=True,
+        blank=True,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="+",
+    )
+    sender = models.CharField(max_length=6, choices=Message.ROLE_CHOICES)
+    message_count = models.PositiveIntegerField(default=0)
+    input_tokens = models.PositiveBigIntegerField(default=0)
+    output_tokens = models.PositiveBigIntegerField(default=0)
+    cost = models.DecimalField(max_digits=16, decimal_places=6, default=0)
+
+    def __str__(self):
+        return f"{self.date} {self.sender}: {self.message_count} messages, {self.cost} $"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "is_muhbir", "api_key", "sender"],
+                condition=models.Q(api_key__isnull=False),
+                name="unique_usage_rollup",
+            ),
+            models.UniqueConstraint(
+                fields=["date", "is_muhbir", "sender"],
+                condition=models.Q(api_key__isnull=True),
+                name="unique_usage_rollup_without_key",
+            ),
+        ]
+
+    @staticmethod
+    def usage(sender, message_count, input_tokens, content_tokens):
+        """
+        Return (input tokens, output tokens, cost) of messages. AI answers are
+        billed their prompt and their content plus 5 tokens per message.
+        """
+        if sender != "ai":
+            return 0, 0, Decimal(0)
+        output_tokens = content_tokens + 5 * message_count
+        cost = (
+            Decimal(input_tokens) * Decimal(str(settings.INPUT_TOKEN_PRICE))
+            + Decimal(output_tokens) * Decimal(str(settings.OUTPUT_TOKEN_PRICE))
+        ) / 1_000_000
+        return input_tokens, output_tokens, cost.quantize(Decimal("0.000001"))
+
+    @classmethod
+    def add(cls, message, is_muhbir):
+        """
+        Count a newly written message, creating the row for its day if needed.
+        """
+        input_tokens, output_tokens, cost = cls.usage(
+            message.sender, 1, message.input_tokens, message.tokens
+        )
+        rows = cls.objects.filter(
+            date=timezone.localdate(message.timestamp),
+            is_muhbir=is_muhbir,
+            api_key_id=message.api_key_id,
+            sender=message.sender,
+        )
+        changes = {
+            "message_count": F("message_count") + 1,
+            "input_tokens": F("input_tokens") + input_tokens,
+            "output_tokens": F("output_tokens") + output_tokens,
+            "cost": F("cost") + cost,
+        }
+        if rows.update(**changes):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    date=timezone.localdate(message.timestamp),
+                    is_muhbir=is_muhbir,
+                    api_key_id=message.api_key_id,
+                    sender=message.sender,
+                    message_count=1,
+                    input_tokens=input_tokens,
+                    output_tokens=output_tokens,
+                    cost=cost,
+                )
+        except IntegrityError:
+            # Another request created the row in the meantime
+            rows.update(**changes)
+
+    @classmethod
+    def rebuild(cls, since=None):
+        """
+        Recompute the rows from Message, for every day or from `since` on.
+        Days are rebuilt one at a time, each in its own short transaction.
+        Returns the number of rows written.
+        """
+        messages = Message.objects.aggregate(
+            first=models.Min("timestamp"), last=models.Max("timestamp")
+        )
+        rollups = cls.objects.aggregate(
+            first=models.Min("date"), last=models.Max("date")
+        )
+        first = [
+            timezone.localdate(messages["first"]) if messages["first"] else None,
+            rollups["first"],
+        ]
+        last = [
+            timezone.localdate(messages["last"]) if messages["last"] else None,
+            rollups["last"],
+        ]
+        if since is None:
+            if not any(first):
+                return 0
+            since = min(day for day in first if day)
+        last = max(day for day in last + [timezone.localdate()] if day)
+
+        written = 0
+        day = since
+        while day <= last:
+            written += cls.rebuild_day(day)
+            day += timedelta(days=1)
+        return written
+
+    @classmethod
+    def rebuild_day(cls, day):
+        """
+        Recompute the rows of one day from Message. Returns the number of rows
+        written.
+        """
+        start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+        end = timezone.make_aware(
+            datetime.combine(day + timedelta(days=1), datetime.min.time())
+        )
+        groups = (
+            Message.objects.filter(timestamp__gte=start, timestamp__lt=end)
+            .values("conversation__client__is_muhbir", "api_key_id", "sender")
+            .annotate(
+                message_count=models.Count("id"),
+                input_total=models.Sum("input_tokens"),
+                content_total=models.Sum("tokens"),
+            )
+            .order_by()
+        )
+
+        def rows():
+            for group in groups.iterator():
+                input_tokens, output_tokens, cost = cls.usage(
+                    group["sender"],
+                    group["message_count"],
+                    group["input_total"] or 0,
+                    group["content_total"] or 0,
+                )
+                yield cls(
+                    date=day,
+                    is_muhbir=group["conversation__client__is_muhbir"],
+                    api_key_id=group["api_key_id"],
+                    sender=group["sender"],
+                    message_count=group["message_count"],
+                    input_tokens=input_tokens,
+                    output_tokens=output_tokens,
+                    cost=cost,
+                )
+
+        with transaction.atomic():
+            # Messages are saved together with their rollup update, so holding
+            # off new messages until the day is rewritten keeps them from
+            # being counted twice or lost. On PostgreSQL a SHARE lock waits for
+            # the saves in flight and blocks new ones, for the one day's
+            # aggregate only; SQLite has one writer, and the delete below
+            # takes the write lock before Message is read.
+            if connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"LOCK TABLE {Message._meta.db_table} IN SHARE MODE"
+                    )
+            cls.objects.filter(date=day).delete()
+            return len(cls.objects.bulk_create(rows(), batch_size=1000))
 
 
 class Muhbir(models.Model):
@@ -294,7 +760,7 @@ class Muhbir(models.Model):
         return f"Muhbir: {self.user.username}"
 
 
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
 
 
 class Category(models.Model):
@@ -302,6 +768,27 @@ class Category(models.Model):
 
     @classmethod
     def getAllCategories(cls):
+        """
+        Catalog of all categories for the chooser prompt, cached until the catalog changes.
+        """
+        return get_or_load_versioned(
+            "catalog", "categories", cls._formatAllCategories, settings.CATALOG_CACHE_TTL
+        )
+
+    @classmethod
+    def get_all_ids(cls):
+        """
+        Set of all category ids, cached until the catalog changes.
+        """
+        return get_or_load_versioned(
+            "catalog",
+            "category_ids",
+            lambda: set(cls.objects.values_list("id", flat=True)),
+            settings.CATALOG_CACHE_TTL,
+        )
+
+    @classmethod
+    def _formatAllCategories(cls):
         # Retrieve all records from the database
         all_data = cls.objects.all()
         # Format each record as 'id:{number}-heading:{heading};'
@@ -339,42 +826,120 @@ class Category(models.Model):
         if total_categories == 0:
             return 0  # Avoid division by zero if there are no categories
 
-        # Calculate the total length of all category names combined
-        total_length = sum(len(data.name) for data in all_data)
+        # Calculate the total tokens of all category names combined
+        total_tokens = sum(count_tokens(data.name) for data in all_data)
 
-        # Calculate the average token size, dividing by total categories and then by 4
-        average_token_size = (total_length / total_categories) // 4
+        # Calculate the average token size, dividing by total categories
+        average_token_size = total_tokens // total_categories
 
         return average_token_size
 
     @classmethod
     def calculate_average_headings_token_by_cat(cls):
         """
-        Calculate the average token size for headings across all categories.
-        This method calculates the total token size for articles in each category,
-        then averages it across all categories.
+        Calculate the average token size for headings across all categories:
+        the token size of the last 500 articles of each category (see
+        AiData.get_token_size_by_category), averaged over all categories.
+        Read from CategoryStats, so no article is loaded.
         """
-        cats = cls.objects.all()
+        total_categories = cls.objects.count()
 
-        if not cats.exists():
+        if total_categories == 0:
             return 0  # Return 0 if there are no categories
 
-        total_tokens = 0
-        total_categories = cats.count()
+        total_tokens = sum(
+            stats.window_content_tokens() for stats in CategoryStats.objects.all()
+        )
 
-        for cat in cats:
+        # Return the average token size for headings across all categories
+        return total_tokens // total_categories
 
-            token_size_for_cat = AiData.get_token_size_by_category(category_id=cat.id)
-            total_tokens += token_size_for_cat
 
-        # Return the average token size for headings across all categories
-        return total_tokens // total_categories if total_categories > 0 else 0
+# Hot articles, so the ones asked about again and again are not re-read
+article_cache = LRUCache("articles", settings.ARTICLE_CACHE_MAX_BYTES)
 
 
 class AiData(models.Model):
     categories = models.ManyToManyField(Category, related_name="articles")
     heading = models.TextField()
     content = models.TextField()
+    # Tokens of heading and content, counted on save so budgets never re-scan the text
+    heading_tokens = models.PositiveIntegerField(default=0, editable=False)
+    content_tokens = models.PositiveIntegerField(default=0, editable=False)
+    # Source of articles ingested from a feed; the hash finds them again on reruns
+    link = models.URLField(max_length=500, blank=True, default="")
+    link_hash = models.CharField(
+        max_length=32, unique=True, null=True, blank=True, editable=False
+    )
+    # Hash of the normalized heading and content; the same article is stored once
+    content_hash = models.CharField(
+        max_length=32, unique=True, null=True, blank=True, editable=False
+    )
+
+    def save(self, *args, **kwargs):
+        self.update_token_counts()
+        self.update_content_hash()
+        self.link_hash = self.hash_link(self.link)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"heading", "content"} & set(update_fields):
+            kwargs["update_fields"] = {
+                *update_fields,
+                "heading_tokens",
+                "content_tokens",
+                "content_hash",
+            }
+        if update_fields is not None and "link" in update_fields:
+            kwargs["update_fields"] = {*kwargs["update_fields"], "link_hash"}
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def hash_link(link):
+        """
+        Hash identifying the article behind a link, None without a link.
+        """
+        link = (link or "").strip().rstrip("/")
+        if not link:
+            return None
+        return hashlib.md5(link.encode("utf-8")).hexdigest()
+
+    def clean(self):
+        self.update_content_hash()
+        duplicate = (
+            AiData.objects.filter(content_hash=self.content_hash)
+            .exclude(pk=self.pk)
+            .values_list("id", flat=True)
+            .first()
+        )
+        if duplicate is not None:
+            raise ValidationError(
+                f"An article with the same heading and content exists (id {duplicate})."
+            )
+
+    @staticmethod
+    def hash_content(heading, content):
+        """
+        Hash of an article that ignores case, Unicode forms and whitespace,
+        so a re-uploaded copy of an article hashes the same.
+        """
+        text = "\n".join(
+            " ".join(unicodedata.normalize("NFKC", part).casefold().split())
+            for part in (heading, content)
+        )
+        return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+    def update_content_hash(self):
+        """
+        Store the content hash; call it before bulk_create or bulk_update.
+        """
+        self.content_hash = self.hash_content(self.heading, self.content)
+
+    def update_token_counts(self):
+        """
+        Store the token counts of heading and content; call it before
+        bulk_create or bulk_update, which skip save().
+        """
+        self.heading_tokens = count_tokens(self.heading)
+        self.content_tokens = count_tokens(self.content)
 
     @classmethod
     def getLast500(cls):
@@ -386,23 +951,43 @@ class AiData(models.Model):
     @classmethod
     def getData(cls, id):
         """
-        Retrieve a single article by id, limited to the last 500 articles.
+        Retrieve a single article by id. Articles are kept in the per-process
+        article cache under their own version, which changed() moves on when
+        that article is saved or deleted anywhere; unknown ids are kept under
+        the version of all articles, which moves on when one is added.
         """
-        last_500_ids = cls.getLast500().values_list("id", flat=True)
         try:
             id = int(id)
         except (ValueError, TypeError):
             return None  # Invalid ID format
 
+        key = (id, get_version(f"article:{id}"))
+        data = article_cache.get(key, MISSING)
+        if data is not MISSING:
+            return data
+        missing_key = (*key, get_version("articles"))
+        if article_cache.get(missing_key, MISSING) is None:
+            return None
+
         # Safely retrieve data, handling potential errors
         try:
             data = cls.objects.get(id=id)
-            return data
         except ObjectDoesNotExist:
-            return None  # Handle if the object does not exist
+            data = None  # Handle if the object does not exist
         except Exception as e:
             # Optionally log the exception or handle other errors
             return None
+        article_cache.set(missing_key if data is None else key, data)
+        return data
+
+    @staticmethod
+    def changed(article_ids):
+        """
+        Make every process re-read these articles in getData. Called for
+        saves and deletes by signals; call it after bulk_update.
+        """
+        for article_id in article_ids:
+            bump_version(f"article:{article_id}")
 
     @classmethod
     def getAllHeadings(cls):
@@ -418,8 +1003,19 @@ class AiData(models.Model):
     @classmethod
     def getAllHeadingsByCat(cls, cat):
         """
-        Retrieve headings for the last 500 records filtered by category.
+        Retrieve headings for the last 500 records filtered by category,
+        cached until the catalog changes.
         """
+        cat = getattr(cat, "pk", cat)
+        return get_or_load_versioned(
+            "catalog",
+            f"headings:{cat}",
+            lambda: cls._formatHeadingsByCat(cat),
+            settings.CATALOG_CACHE_TTL,
+        )
+
+    @classmethod
+    def _formatHeadingsByCat(cls, cat):
         all_data = cls.objects.filter(categories=cat).order_by("-id")[:500]
         result = []
         for data in all_data:
@@ -451,27 +1047,122 @@ class AiData(models.Model):
 
         return total_length // count
 
+    @classmethod
+    def getMeanContentTokens(cls):
+        """
+        Mean content tokens of the last 500 records.
+        """
+        mean = cls.getLast500().aggregate(mean=models.Avg("content_tokens"))["mean"]
+        return int(mean or 0)
+
     @classmethod
     def calculate_token_size(cls, content):
         """
-        Simple token size calculation: assume 1 token for every 4 characters.
+        Token size of a text with the configured tokenizer (see api.tokenizer).
         """
-        return len(content) // 4
+        return count_tokens(content)
 
     @classmethod
     def get_token_size_by_category(cls, category_id):
         """
         Calculate the token size for the last 500 articles in a specific category.
         """
-        try:
-            category = Category.objects.get(id=category_id)
-        except Category.DoesNotExist:
-            return 0  # Return 0 if the category doesn't exist
+        stats = CategoryStats.objects.filter(category_id=category_id).first()
+        return stats.window_content_tokens() if stats is not None else 0
+
+
+class CategoryStats(models.Model):
+    """
+    Article count and token totals of a category, recounted for the
+    categories an article change touches so the token estimators read one
+    row per category instead of scanning articles.
+    """
+
+    # Articles per category the heading chooser sends (see getAllHeadingsByCat)
+    WINDOW = 500
+
+    category = models.OneToOneField(
+        Category, on_delete=models.CASCADE, primary_key=True, related_name="stats"
+    )
+    article_count = models.PositiveIntegerField(default=0)
+    heading_tokens = models.PositiveBigIntegerField(default=0)
+    content_tokens = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
 
-        articles = cls.objects.filter(categories=category).order_by("-id")[:500]
+    class Meta:
+        verbose_name_plural = "category stats"
 
-        total_tokens = 0
-        for article in articles:
-            total_tokens += cls.calculate_token_size(article.content)
+    def __str__(self):
+        return f"{self.category_id}: {self.article_count} articles"
 
-        return total_tokens
+    def window_content_tokens(self):
+        """
+        Content tokens of the last WINDOW articles, estimated from the mean
+        once the category has more articles than that.
+        """
+        if self.article_count <= self.WINDOW:
+            return self.content_tokens
+        return self.content_tokens * self.WINDOW // self.article_count
+
+    @classmethod
+    def refresh(cls, category_ids=None):
+        """
+        Recount the given categories (all when None) with one grouped query
+        over the category links, and store the totals.
+        """
+        links = AiData.categories.through.objects.all()
+        categories = Category.objects.all()
+        if category_ids is not None:
+            category_ids = set(category_ids)
+            if not category_ids:
+                return
+            links = links.filter(category_id__in=category_ids)
+            categories = categories.filter(id__in=category_ids)
+
+        totals = {
+            row["category_id"]: row
+            for row in links.values("category_id")
+            .annotate(
+                article_count=models.Count("aidata_id"),
+                heading_tokens=models.Sum("aidata__heading_tokens"),
+                content_tokens=models.Sum("aidata__content_tokens"),
+            )
+            .order_by()
+        }
+        stats = []
+        for category_id in categories.values_list("id", flat=True):
+            row = totals.get(category_id, {})
+            stats.append(
+                cls(
+                    category_id=category_id,
+                    article_count=row.get("article_count", 0),
+                    heading_tokens=row.get("heading_tokens") or 0,
+                    content_tokens=row.get("content_tokens") or 0,
+                )
+            )
+        cls.objects.bulk_create(
+            stats,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["category"],
+            update_fields=[
+                "article_count",
+                "heading_tokens",
+                "content_tokens",
+                "updated_at",
+            ],
+        )
+
+
+class FeedCursor(models.Model):
+    """
+    High-water mark of a feed: the newest publication date ingested, so
+    reruns of ingest_feed skip the items processed before.
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    high_water = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.high_water}"
@@ -0,0 +1,119 @@
+import os
+import threading
+from collections import OrderedDict
+
+import google.generativeai as genai
+from django.conf import settings
+
+# httpx2 is the HTTP library the openai package is built on (a dependency of openai)
+from httpx2 import Limits
+from openai import (
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+    DefaultHttpxClient,
+    OpenAI,
+    Timeout,
+)
+
+GEMINI_MODEL = "gemini-1.5-flash-latest"
+GEMINI_GENERATION_CONFIG = {"temperature": 0.7, "max_output_tokens": 500}
+
+_lock = threading.Lock()
+_models = OrderedDict()  # (model name, instruction, config, tools) -> GenerativeModel
+_clients = {}
+
+
+def gemini_model(
+    system_instruction, model_name=GEMINI_MODEL, generation_config=None, tools=None
+):
+    """
+    Return a GenerativeModel for the system instruction, reused between calls.
+    Models are kept per model name, system instruction (looked up by its hash,
+    which Python computes once per string), generation config and tools; the
+    least recently used ones are dropped beyond LLM_MODEL_POOL_SIZE.
+    """
+    generation_config = generation_config or GEMINI_GENERATION_CONFIG
+    key = (
+        model_name,
+        system_instruction,
+        tuple(sorted(generation_config.items())),
+        tuple(tool.__name__ for tool in tools or ()),
+    )
+    with _lock:
+        model = _models.get(key)
+        if model is not None:
+            _models.move_to_end(key)
+            return model
+
+    model = genai.GenerativeModel(
+        model_name=model_name,
+        generation_config=genai.types.GenerationConfigDict(generation_config),
+        system_instruction=system_instruction,
+        tools=tools,
+    )
+    with _lock:
+        _models[key] = model
+        while len(_models) > settings.LLM_MODEL_POOL_SIZE:
+            _models.popitem(last=False)
+    return model
+
+
+def gemini_request_options():
+    # gRPC has no separate connect timeout, the deadline covers the whole call
+    return {"timeout": settings.LLM_CONNECT_TIMEOUT + settings.LLM_READ_TIMEOUT}
+
+
+def http_timeout():
+    return Timeout(
+        settings.LLM_READ_TIMEOUT,
+        connect=settings.LLM_CONNECT_TIMEOUT,
+        pool=settings.LLM_CONNECT_TIMEOUT,
+    )
+
+
+def http_limits():
+    return Limits(
+        max_connections=settings.LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+def _client(name, factory):
+    with _lock:
+        client = _clients.get(name)
+        if client is None:
+            client = _clients[name] = factory()
+    return client
+
+
+def openai_client():
+    """
+    The process wide OpenAI client, with a keep-alive connection pool so hot
+    calls reuse open TLS connections.
+    """
+    return _client(
+        "openai",
+        lambda: OpenAI(
+            api_key=os.getenv("gpt_token"),
+            timeout=http_timeout(),
+            max_retries=settings.LLM_MAX_RETRIES,
+            http_client=DefaultHttpxClient(
+                limits=http_limits(), timeout=http_timeout()
+            ),
+        ),
+    )
+
+
+def async_openai_client():
+    return _client(
+        "async_openai",
+        lambda: AsyncOpenAI(
+            api_key=os.getenv("gpt_token"),
+            timeout=http_timeout(),
+            max_retries=settings.LLM_MAX_RETRIES,
+            http_client=DefaultAsyncHttpxClient(
+                limits=http_limits(), timeout=http_timeout()
+            ),
+        ),
+    )
@@ -0,0 +1,564 @@
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from . import cache
+from .cache import bump_version, get_version
+
+logger = logging.getLogger("daryo-api")
+
+# Words in any script (Latin and Cyrillic Uzbek, Russian, English)
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    """
+    Split text into lowercase words, dropping one-character ones.
+    """
+    return [word for word in WORD_RE.findall(text.lower()) if len(word) > 1]
+
+
+class BM25Index:
+    """
+    In-process BM25 index over AiData headings and contents. Articles can be
+    added, replaced and removed one at a time, so the index is kept up to date
+    from model signals instead of being rebuilt on every change.
+    """
+
+    def __init__(self, k1=1.5, b=0.75, heading_weight=2):
+        self.k1 = k1
+        self.b = b
+        self.heading_weight = heading_weight
+
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict)  # term -> {article id: term frequency}
+        self._doc_terms = {}  # article id -> Counter of its terms
+        self._doc_length = {}  # article id -> number of terms
+        self._total_length = 0
+        self.built_at = None
+        self.version = None  # catalog version the index reflects
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def _terms(self, heading, content):
+        # Headings say what an article is about, so their words count more
+        return Counter(tokenize(heading) * self.heading_weight + tokenize(content))
+
+    def add(self, article_id, heading, content):
+        """
+        Index an article, replacing the previous version if it was indexed.
+        """
+        terms = self._terms(heading, content)
+        with self._lock:
+            self._remove(article_id)
+            for term, frequency in terms.items():
+                self._postings[term][article_id] = frequency
+            self._doc_terms[article_id] = terms
+            self._doc_length[article_id] = sum(terms.values())
+            self._total_length += self._doc_length[article_id]
+
+    def remove(self, article_id):
+        with self._lock:
+            self._remove(article_id)
+
+    def _remove(self, article_id):
+        terms = self._doc_terms.pop(article_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop(article_id, None)
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._doc_length.pop(article_id)
+
+    def build(self, rows, version=None):
+        """
+        Replace the whole index with `rows` of (id, heading, content).
+        """
+        # Build aside and swap, so searches are not blocked while rows are read
+        fresh = BM25Index(self.k1, self.b, self.heading_weight)
+        for article_id, heading, content in rows:
+            fresh.add(article_id, heading, content)
+
+        with self._lock:
+            self._postings = fresh._postings
+            self._doc_terms = fresh._doc_terms
+            self._doc_length = fresh._doc_length
+            self._total_length = fresh._total_length
+            self.built_at = time.monotonic()
+            self.version = version
+
+    def search(self, query, k=5):
+        """
+        Return up to `k` (article id, score) pairs best matching `query`, best first.
+        """
+        with self._lock:
+            documents = len(self._doc_terms)
+            if not documents:
+                return []
+            average_length = self._total_length / documents
+
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5))
+                for article_id, frequency in postings.items():
+                    length = self._doc_length[article_id]
+                    norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[article_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+lexical_index = BM25Index()
+# Held while an index is built for the first time, so a process builds it once
+lexical_build_lock = threading.Lock()
+
+
+def articles_changed(article_ids=None):
+    """
+    Move the indexed articles to a new version and log the ids of the
+    articles whose text changed under it, so the indexes of every process
+    apply just those (see catch_up). Without ids, or with more than
+    RETRIEVAL_MAX_CHANGES, nothing is logged and the indexes are rebuilt.
+    Returns the new version.
+    """
+    version = bump_version("articles")
+    if article_ids is not None and len(article_ids) <= settings.RETRIEVAL_MAX_CHANGES:
+        cache.store(
+            "articles_change",
+            version,
+            list(article_ids),
+            settings.RETRIEVAL_CHANGE_LOG_TTL,
+        )
+    return version
+
+
+def catch_up(index, version):
+    """
+    Bring an index to `version` by re-reading the articles logged as changed
+    since its own version. Returns False, leaving the index as it was, when
+    the changes are not all logged (bulk changes, too many, or expired); the
+    index then has to be rebuilt.
+    """
+    from .models import AiData
+
+    if index.version is not None and index.version >= version:
+        return True
+    if (
+        index.version is None
+        or version - index.version > settings.RETRIEVAL_MAX_CHANGES
+    ):
+        return False
+    versions = range(index.version + 1, version + 1)
+    logged = cache.lookup_many("articles_change", versions)
+    if len(logged) < len(versions):
+        return False
+
+    article_ids = set().union(*logged.values())
+    rows = {
+        article_id: (heading, content)
+        for article_id, heading, content in AiData.objects.filter(
+            id__in=article_ids
+        ).values_list("id", "heading", "content")
+    }
+    for article_id in article_ids:
+        if article_id in rows:
+            index.add(article_id, *rows[article_id])
+        else:
+            index.remove(article_id)
+    index.version = version
+    return True
+
+
+def is_too_old(index):
+    """
+    Whether an index is older than RETRIEVAL_INDEX_MAX_AGE; it is then
+    rebuilt in case a change was missed.
+    """
+    return time.monotonic() - index.built_at > settings.RETRIEVAL_INDEX_MAX_AGE
+
+
+_rebuilding_lock = threading.Lock()
+_rebuilding = set()  # names of the indexes being rebuilt in this process
+
+
+def rebuild_in_background(name, rebuild):
+    """
+    Call `rebuild` in a thread unless the index `name` is being rebuilt
+    already, so requests keep searching the current index meanwhile.
+    """
+    with _rebuilding_lock:
+        if name in _rebuilding:
+            return
+        _rebuilding.add(name)
+
+    def run():
+        try:
+            rebuild()
+        except Exception:
+            logger.exception(f"Rebuilding the {name} index failed")
+        finally:
+            # The thread's own database connection
+            connection.close()
+            with _rebuilding_lock:
+                _rebuilding.discard(name)
+
+    threading.Thread(target=run, name=f"rebuild-{name}", daemon=True).start()
+
+
+def article_rows():
+    from .models import AiData
+
+    return AiData.objects.values_list("id", "heading", "content").iterator()
+
+
+def rebuild_lexical_index():
+    # The version is read before the rows, so changes made while they are
+    # read are applied again by catch_up rather than missed
+    version = get_version("articles")
+    lexical_index.build(article_rows(), version)
+
+
+def get_lexical_index():
+    """
+    Return the BM25 index. It is built from the database on first use; after
+    that it follows article changes made anywhere (see catch_up) and is
+    rebuilt in the background when it cannot or is too old.
+    """
+    if lexical_index.built_at is None:
+        with lexical_build_lock:
+            if lexical_index.built_at is None:
+                rebuild_lexical_index()
+        return lexical_index
+
+    if not catch_up(lexical_index, get_version("articles")) or is_too_old(
+        lexical_index
+    ):
+        rebuild_in_background("lexical", rebuild_lexical_index)
+    return lexical_index
+
+
+class HashingEmbedder:
+    """
+    Offline embedder: words and character trigrams of words are hashed into
+    `dim` signed buckets and the vector is L2 normalized. Trigrams let
+    inflected forms of the same word (common in Uzbek) land close together.
+    """
+
+    def __init__(self, dim=512, trigram_weight=0.5):
+        self.dim = dim
+        self.trigram_weight = trigram_weight
+
+    @property
+    def name(self):
+        return f"hashing-{self.dim}"
+
+    def _features(self, text):
+        for word in tokenize(text):
+            yield word, 1.0
+            marked = f"#{word}#"
+            for i in range(len(marked) - 2):
+                yield marked[i : i + 3], self.trigram_weight
+
+    def embed(self, texts):
+        """
+        Return a float32 matrix with one normalized row per text.
+        """
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            buckets = []
+            weights = []
+            for feature, weight in self._features(text):
+                # crc32 is stable between processes, unlike hash()
+                hashed = zlib.crc32(feature.encode("utf-8"))
+                buckets.append(hashed % self.dim)
+                weights.append(weight if hashed & 0x80000000 else -weight)
+            if buckets:
+                vectors[row] = np.bincount(buckets, weights=weights, minlength=self.dim)
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+
+def get_embedder():
+    """
+    Return an instance of the embedder configured by settings.VECTOR_EMBEDDER.
+    An embedder has a `dim`, a `name` identifying the vectors it makes, and
+    `embed(texts)` returning a float32 matrix of normalized rows.
+    """
+    return import_string(settings.VECTOR_EMBEDDER)()
+
+
+class VectorIndex:
+    """
+    Dense vectors of AiData articles kept as one float32 matrix, so a query is
+    scored against the whole corpus with a single matrix product. The matrix
+    is saved as .npy files and loaded memory-mapped.
+    """
+
+    def __init__(self, embedder):
+        self.embedder = embedder
+        self._lock = threading.RLock()
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.matrix = np.zeros((0, embedder.dim), dtype=np.float32)
+        self.built_at = None
+        self.version = None  # catalog version the index reflects
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def article_text(heading, content):
+        return f"{heading}\n{heading}\n{content}"
+
+    def build(self, rows, version=None, batch_size=256):
+        """
+        Replace the whole index with `rows` of (id, heading, content).
+        """
+        ids = []
+        blocks = []
+        batch = []
+        for article_id, heading, content in rows:
+            ids.append(article_id)
+            batch.append(self.article_text(heading, content))
+            if len(batch) >= batch_size:
+                blocks.append(self.embedder.embed(batch))
+                batch = []
+        if batch:
+            blocks.append(self.embedder.embed(batch))
+
+        matrix = (
+            np.vstack(blocks)
+            if blocks
+            else np.zeros((0, self.embedder.dim), dtype=np.float32)
+        )
+        with self._lock:
+            self.ids = np.asarray(ids, dtype=np.int64)
+            self.matrix = matrix
+            self.built_at = time.monotonic()
+            self.version = version
+
+    def add(self, article_id, heading, content):
+        """
+        Embed an article, replacing its previous vector if it was indexed.
+        """
+        vector = self.embedder.embed([self.article_text(heading, content)])
+        with self._lock:
+            positions = np.flatnonzero(self.ids == article_id)
+            if len(positions):
+                # A memory-mapped matrix is read-only, copy it before writing
+                if not self.matrix.flags.writeable:
+                    self.matrix = np.array(self.matrix)
+                self.matrix[positions[0]] = vector[0]
+            else:
+                self.ids = np.append(self.ids, np.int64(article_id))
+                self.matrix = np.vstack([self.matrix, vector])
+
+    def remove(self, article_id):
+        with self._lock:
+            keep = self.ids != article_id
+            if not keep.all():
+                self.ids = self.ids[keep]
+                self.matrix = np.asarray(self.matrix[keep])
+
+    def search(self, query, k=5):
+        """
+        Return up to `k` (article id, cosine similarity) pairs best matching
+        `query`, best first.
+        """
+        vector = self.embedder.embed([query])[0]
+        with self._lock:
+            ids, matrix = self.ids, self.matrix
+        if not len(ids):
+            return []
+
+        scores = matrix @ vector
+        k = min(k, len(scores))
+        # Only the k best need sorting
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+    def save(self, directory):
+        """
+        Save the index so readers never see a partial one: the files are
+        written to a new directory next to `directory`, which is a symlink
+        switched to it with os.replace; the previous files are then removed.
+        """
+        directory = Path(directory)
+        directory.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            ids, matrix, version = self.ids, self.matrix, self.version
+
+        staging = Path(
+            tempfile.mkdtemp(prefix=f".{directory.name}-", dir=directory.parent)
+        )
+        link = directory.parent / f"{staging.name}.link"
+        try:
+            np.save(staging / "ids.npy", ids)
+            np.save(staging / "vectors.npy", matrix)
+            (staging / "meta.json").write_text(
+                json.dumps(
+                    {
+                        "embedder": self.embedder.name,
+                        "dim": int(matrix.shape[1]),
+                        "count": len(ids),
+                        "version": version,
+                    }
+                )
+            )
+            if directory.is_dir() and not directory.is_symlink():
+                # Saved by an earlier version as a plain directory
+                shutil.rmtree(directory)
+            previous = directory.resolve() if directory.is_symlink() else None
+            os.symlink(staging.name, link)
+            os.replace(link, directory)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            if link.is_symlink():
+                link.unlink()
+            raise
+        if previous is not None and previous != staging:
+            shutil.rmtree(previous, ignore_errors=True)
+
+    def load(self, directory):
+        """
+        Load a saved index memory-mapped, with the articles version it was
+        saved at. Returns False if there is none, it was made by a different
+        embedder, or its files do not agree with each other (e.g. a partial
+        write); the index then has to be rebuilt.
+        """
+        # Resolve the symlink once, so all files come from the same save
+        directory = Path(directory).resolve()
+        try:
+            meta = json.loads((directory / "meta.json").read_text())
+            if meta["embedder"] != self.embedder.name:
+                return False
+            ids = np.load(directory / "ids.npy")
+            matrix = np.load(directory / "vectors.npy", mmap_mode="r")
+            age = time.time() - (directory / "vectors.npy").stat().st_mtime
+        except (OSError, ValueError, KeyError):
+            return False
+
+        if (
+            ids.ndim != 1
+            or matrix.ndim != 2
+            or not len(ids) == matrix.shape[0] == meta.get("count")
+            or matrix.shape[1] != self.embedder.dim
+        ):
+            logger.warning(f"Ignoring inconsistent vector index in {directory}")
+            return False
+
+        # Count the file's age, so an old file is rebuilt from the database soon
+        with self._lock:
+            self.ids = ids
+            self.matrix = matrix
+            self.built_at = time.monotonic() - age
+            self.version = meta.get("version")
+        return True
+
+
+vector_index = None
+# Set once this process has a vector index
+vector_index_ready = threading.Event()
+
+
+def set_vector_index(index):
+    global vector_index
+    vector_index = index
+    vector_index_ready.set()
+
+
+def refresh_vector_index(wait=False):
+    """
+    Replace the vector index with a current one: the one saved in
+    VECTOR_INDEX_DIR if it can be brought up to date, else one built from
+    the database and saved. One process builds at a time, behind a lock in
+    the shared cache. Meanwhile the others keep their index, or use the
+    saved one even if it is not current when they have none, and load the
+    new one later, or with `wait` poll until they can.
+    """
+    while True:
+        version = get_version("articles")
+        index = VectorIndex(get_embedder())
+        loaded = index.load(settings.VECTOR_INDEX_DIR)
+        if loaded and catch_up(index, version) and not is_too_old(index):
+            break
+        # Unique to this build, so only the process holding the lock releases it
+        owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        if cache.add(
+            "lock", "vector_index", owner, settings.VECTOR_INDEX_BUILD_TIMEOUT
+        ):
+            try:
+                index.build(article_rows(), version)
+                index.save(settings.VECTOR_INDEX_DIR)
+            finally:
+                # The lock may have expired and been taken by another process
+                if cache.lookup("lock", "vector_index") == owner:
+                    cache.invalidate("lock", "vector_index")
+            break
+        if loaded and vector_index is None:
+            set_vector_index(index)
+        if not wait:
+            return
+        time.sleep(0.5)
+    set_vector_index(index)
+
+
+def get_vector_index():
+    """
+    Return the vector index, or None while this process has none yet. It is
+    loaded or built in the background on first use (see refresh_vector_index),
+    which requests wait for at most VECTOR_INDEX_WAIT seconds. After that it
+    follows article changes made anywhere (see catch_up) and is refreshed in
+    the background when it cannot or is too old.
+    """
+    if vector_index is None:
+        rebuild_in_background("vector", lambda: refresh_vector_index(wait=True))
+        vector_index_ready.wait(settings.VECTOR_INDEX_WAIT)
+        return vector_index
+
+    if not catch_up(vector_index, get_version("articles")) or is_too_old(
+        vector_index
+    ):
+        rebuild_in_background("vector", refresh_vector_index)
+    return vector_index
+
+
+def apply_change(version, article_id, heading=None, content=None):
+    """
+    Apply an article change made in this process, logged as `version` by
+    articles_changed, to the indexes built here: index the article, or remove
+    it when no heading is given. Indexes that were current before the change
+    stay current without waiting for catch_up.
+    """
+    for index in (lexical_index, vector_index):
+        if index is None or index.built_at is None:
+            continue
+        if heading is None:
+            index.remove(article_id)
+        else:
+            index.add(article_id, heading, content)
+        if index.version == version - 1:
+            index.version = version
@@ -0,0 +1,175 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import retrieval
+from .cache import bump_version, invalidate
+from .models import (
+    AiData,
+    APIKey,
+    Category,
+    CategoryStats,
+    Client,
+    ClientDailyUsage,
+    Conversation,
+    Counter,
+    DailyUsageRollup,
+    Message,
+    UsageLimit,
+    request_counter,
+    tokens_counter,
+)
+
+
+@receiver(post_save, sender=APIKey)
+@receiver(post_delete, sender=APIKey)
+def invalidate_api_key(sender, instance, update_fields=None, **kwargs):
+    """
+    Drop the cached key whenever it is changed from the admin or deleted,
+    so a deactivated key stops working immediately in this process and
+    within API_KEY_CACHE_TTL seconds everywhere else.
+    """
+    if update_fields and set(update_fields) <= APIKey.COUNTER_FIELDS:
+        return
+    invalidate("apikey", instance.key)
+    # the usage counters may have been edited by hand, re-read them on next use
+    request_counter.reset(instance.pk)
+    tokens_counter.reset(instance.pk)
+
+
+@receiver(post_save, sender=UsageLimit)
+@receiver(post_delete, sender=UsageLimit)
+def invalidate_usage_limit(sender, instance, **kwargs):
+    invalidate("usagelimit", bool(instance.is_muhbir))
+
+
+@receiver(post_save, sender=Message)
+def append_message_to_history(sender, instance, created, **kwargs):
+    if created:
+        Conversation.append_to_history(instance.conversation_id, instance)
+
+
+@receiver(post_save, sender=Message)
+def add_message_to_rollup(sender, instance, created, **kwargs):
+    if created:
+        DailyUsageRollup.add(instance, instance.client_is_muhbir())
+
+
+@receiver(post_save, sender=Message)
+def count_client_message(sender, instance, created, **kwargs):
+    """
+    Keep the per-day message counter of the client up to date.
+    """
+    if created and instance.sender == "client":
+        ClientDailyUsage.increment(
+            instance.conversation.client_id, timezone.localdate(instance.timestamp)
+        )
+
+
+@receiver(post_save, sender=Client)
+def count_created_client(sender, instance, created, **kwargs):
+    # Clients created through get_or_create_within_limit are counted already
+    if created and not getattr(instance, "_counted", False):
+        Counter.increment(Client.COUNTER_NAME)
+
+
+@receiver(post_delete, sender=Client)
+def uncount_deleted_client(sender, instance, **kwargs):
+    Counter.decrement(Client.COUNTER_NAME)
+
+
+def bump_catalog_on_commit():
+    """
+    Move the catalog to a new version once the change is committed; bumped
+    earlier, a worker could cache the old catalog under the new version.
+    """
+    transaction.on_commit(lambda: bump_version("catalog"))
+
+
+@receiver(post_save, sender=AiData)
+def article_saved(sender, instance, update_fields=None, **kwargs):
+    """
+    Move the catalog to a new version once committed, so cached catalog
+    strings are rebuilt by every worker, drop the article from the article
+    caches and, when the text changed, update the retrieval indexes of this
+    process in place and log the change for the others.
+    """
+    bump_catalog_on_commit()
+    article_id, heading, content = instance.id, instance.heading, instance.content
+    # Other processes re-read the article, so tell them once it is committed
+    transaction.on_commit(lambda: AiData.changed([article_id]))
+    if update_fields is not None and not {"heading", "content"} & set(update_fields):
+        return
+    transaction.on_commit(
+        lambda: retrieval.apply_change(
+            retrieval.articles_changed([article_id]), article_id, heading, content
+        )
+    )
+
+
+@receiver(post_delete, sender=AiData)
+def article_deleted(sender, instance, **kwargs):
+    bump_catalog_on_commit()
+    article_id = instance.id
+    transaction.on_commit(lambda: AiData.changed([article_id]))
+    transaction.on_commit(
+        lambda: retrieval.apply_change(
+            retrieval.articles_changed([article_id]), article_id
+        )
+    )
+
+
+# Categories are not indexed for retrieval, only the catalog strings change
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    bump_catalog_on_commit()
+
+
+@receiver(m2m_changed, sender=AiData.categories.through)
+def article_categories_changed(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        bump_catalog_on_commit()
+
+
+@receiver(post_save, sender=AiData)
+def refresh_stats_of_saved_article(
+    sender, instance, created, update_fields=None, **kwargs
+):
+    # A new article has no categories yet, they are counted as they are added
+    if created:
+        return
+    counted = {"heading_tokens", "content_tokens"}
+    if update_fields is not None and not counted & set(update_fields):
+        return
+    CategoryStats.refresh(instance.categories.values_list("id", flat=True))
+
+
+@receiver(pre_delete, sender=AiData)
+def remember_categories_of_deleted_article(sender, instance, **kwargs):
+    instance._category_ids = list(instance.categories.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=AiData)
+def refresh_stats_of_deleted_article(sender, instance, **kwargs):
+    CategoryStats.refresh(getattr(instance, "_category_ids", []))
+
+
+@receiver(m2m_changed, sender=AiData.categories.through)
+def refresh_stats_of_linked_categories(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    """
+    Recount the categories whose links changed; from the category side
+    (category.articles) that is the category itself.
+    """
+    if reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            CategoryStats.refresh([instance.pk])
+    elif action == "pre_clear":
+        instance._category_ids = list(instance.categories.values_list("id", flat=True))
+    elif action == "post_clear":
+        CategoryStats.refresh(getattr(instance, "_category_ids", []))
+    elif action in ("post_add", "post_remove"):
+        CategoryStats.refresh(pk_set)
@@ -0,0 +1,108 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+
+from api.models import APIKey, Client, Conversation, Message
+
+CONVERSATION_URL = "/daryo-api/api/v1/ai/conversation/"
+
+
+class ConversationPagesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api_key = APIKey.objects.create()
+        self.client_row = Client.objects.create(external_id="pages-test", name="Test")
+        self.conversation = Conversation.objects.create(client=self.client_row)
+
+        start = timezone.now() - timedelta(hours=1)
+        self.messages = [
+            # Pairs share a timestamp, so pages must also be ordered by id
+            Message.objects.create(
+                conversation=self.conversation,
+                sender="client" if number % 2 else "ai",
+                content=f"message {number}",
+                timestamp=start + timedelta(seconds=number // 2),
+            )
+            for number in range(7)
+        ]
+
+    def get(self, headers=None, **params):
+        return self.client.get(
+            CONVERSATION_URL,
+            {"external_id": "pages-test", **params},
+            headers={"X-API-KEY": self.api_key.key, **(headers or {})},
+        )
+
+    def ids(self, response):
+        return [message["id"] for message in response.json()["messages"]]
+
+    def test_latest_page(self):
+        response = self.get(limit=3)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.ids(response), [m.id for m in self.messages[4:]])
+        self.assertIsNotNone(response.json()["cursors"]["before"])
+        self.assertFalse(response.json()["has_more"])
+
+    def test_before_cursor_walks_back_through_every_message(self):
+        ids = []
+        response = self.get(limit=3)
+        while True:
+            ids = self.ids(response) + ids
+            before = response.json()["cursors"]["before"]
+            if before is None:
+                break
+            response = self.get(limit=3, before=before)
+            self.assertTrue(response.json()["has_more"])
+        self.assertEqual(ids, [m.id for m in self.messages])
+
+    def test_after_cursor_returns_new_messages(self):
+        after = self.get(limit=3).json()["cursors"]["after"]
+        response = self.get(after=after)
+        self.assertEqual(self.ids(response), [])
+        self.assertEqual(response.json()["cursors"]["after"], after)
+
+        new = Message.objects.create(
+            conversation=self.conversation, sender="client", content="new"
+        )
+        response = self.get(after=after)
+        self.assertEqual(self.ids(response), [new.id])
+
+    def test_after_cursor_pages_forward(self):
+        first = self.messages[0]
+        cursor = self.get(limit=1, before=self.get(limit=6).json()["cursors"]["before"])
+        self.assertEqual(self.ids(cursor), [first.id])
+
+        response = self.get(limit=4, after=cursor.json()["cursors"]["after"])
+        self.assertEqual(self.ids(response), [m.id for m in self.messages[1:5]])
+        self.assertTrue(response.json()["has_more"])
+
+    def test_unchanged_conversation_is_not_modified(self):
+        response = self.get(limit=3)
+        etag = response["ETag"]
+
+        response = self.get(limit=3, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        Message.objects.create(
+            conversation=self.conversation, sender="client", content="new"
+        )
+        response = self.get(limit=3, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_etag_depends_on_the_page(self):
+        self.assertNotEqual(self.get(limit=3)["ETag"], self.get(limit=2)["ETag"])
+
+    def test_invalid_parameters(self):
+        cursor = self.get(limit=3).json()["cursors"]["before"]
+        for params in (
+            {"before": "not a cursor"},
+            {"limit": "x"},
+            {"limit": 0},
+            {"before": cursor, "after": cursor},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.get(**params).status_code, 400)
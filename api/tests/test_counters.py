@@ -0,0 +1,62 @@
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase
+
+from api.counters import WriteBehindCounter
+from api.models import APIKey
+
+
+class CounterTestMixin:
+    def setUp(self):
+        cache.clear()
+        self.counter = WriteBehindCounter(
+            "api.APIKey", "request_used", flush_interval=0.2, flush_size=5
+        )
+        self.addCleanup(self.counter.flush)
+        self.api_key = APIKey.objects.create(request_used=5)
+
+    def stored(self):
+        self.api_key.refresh_from_db()
+        return self.api_key.request_used
+
+
+class WriteBehindCounterTests(CounterTestMixin, TestCase):
+    def test_live_value_includes_pending_increments(self):
+        self.assertEqual(self.counter.incr(self.api_key.pk), 6)
+        self.assertEqual(self.counter.incr(self.api_key.pk, 2), 8)
+        self.assertEqual(self.counter.value(self.api_key.pk), 8)
+        self.assertEqual(self.stored(), 5)
+
+    def test_flush_when_enough_increments_are_pending(self):
+        for _ in range(5):
+            self.counter.incr(self.api_key.pk)
+        self.assertEqual(self.stored(), 10)
+
+    def test_live_value_does_not_expire(self):
+        self.counter.incr(self.api_key.pk)
+        # Increments of another process, not flushed yet
+        other = WriteBehindCounter("api.APIKey", "request_used", flush_size=100)
+        other.incr(self.api_key.pk, 10)
+        self.addCleanup(other.flush)
+        later = time.time() + 24 * 3600
+        with mock.patch(
+            "django.core.cache.backends.locmem.time.time", return_value=later
+        ):
+            self.assertEqual(self.counter.value(self.api_key.pk), 16)
+
+    def test_reset_reads_the_database_again(self):
+        self.counter.incr(self.api_key.pk)
+        self.counter.flush()
+        APIKey.objects.filter(pk=self.api_key.pk).update(request_used=0)
+        self.counter.reset(self.api_key.pk)
+        self.assertEqual(self.counter.value(self.api_key.pk), 0)
+
+
+class WriteBehindCounterTimerTests(CounterTestMixin, TransactionTestCase):
+    def test_pending_increments_are_flushed_after_the_interval(self):
+        self.counter.incr(self.api_key.pk)
+        self.assertEqual(self.stored(), 5)
+        time.sleep(0.5)
+        self.assertEqual(self.stored(), 6)
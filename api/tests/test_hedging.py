@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+
+from django.test import SimpleTestCase, override_settings
+
+from api.hedging import AsyncHedged, Hedged, LatencyTracker, hedge_delay
+
+
+def slow(answer, seconds):
+    def call(question):
+        time.sleep(seconds)
+        return answer
+
+    call.__name__ = answer
+    return call
+
+
+def failing(question):
+    raise RuntimeError("provider down")
+
+
+@override_settings(LLM_HEDGE_DELAY=0.05, LLM_HEDGE_MIN_SAMPLES=20)
+class HedgedTests(SimpleTestCase):
+    def test_fast_primary_is_not_hedged(self):
+        calls = []
+
+        def secondary(question):
+            calls.append(question)
+            return "secondary"
+
+        hedged = Hedged(slow("primary", 0), secondary)
+        self.assertEqual(hedged("q"), "primary")
+        self.assertEqual(calls, [])
+
+    def test_first_answer_wins(self):
+        hedged = Hedged(slow("primary", 0.5), slow("secondary", 0))
+        started = time.monotonic()
+        self.assertEqual(hedged("q"), "secondary")
+        self.assertLess(time.monotonic() - started, 0.4)
+
+    def test_failed_primary_falls_back(self):
+        hedged = Hedged(failing, slow("secondary", 0))
+        self.assertEqual(hedged("q"), "secondary")
+
+    def test_failure_of_both_is_raised(self):
+        with self.assertRaises(RuntimeError):
+            Hedged(failing, failing)("q")
+
+    def test_only_primary_calls_are_timed(self):
+        tracker = LatencyTracker()
+        Hedged(slow("primary", 0), slow("secondary", 0), tracker)("q")
+        self.assertEqual(len(tracker), 1)
+
+
+@override_settings(LLM_HEDGE_DELAY=0.05, LLM_HEDGE_MIN_SAMPLES=20)
+class AsyncHedgedTests(SimpleTestCase):
+    def test_first_answer_wins_and_loser_is_cancelled(self):
+        cancelled = threading.Event()
+
+        async def primary(question):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+            return "primary"
+
+        async def secondary(question):
+            return "secondary"
+
+        async def run():
+            answer = await AsyncHedged(primary, secondary)("q")
+            # Let the cancellation reach the losing call
+            await asyncio.sleep(0)
+            return answer
+
+        self.assertEqual(asyncio.run(run()), "secondary")
+        self.assertTrue(cancelled.is_set())
+
+    def test_failed_primary_falls_back(self):
+        async def primary(question):
+            raise RuntimeError("provider down")
+
+        async def secondary(question):
+            return "secondary"
+
+        self.assertEqual(
+            asyncio.run(AsyncHedged(primary, secondary)("q")), "secondary"
+        )
+
+
+class HedgeDelayTests(SimpleTestCase):
+    @override_settings(LLM_HEDGE_DELAY=3, LLM_HEDGE_MIN_SAMPLES=20)
+    def test_configured_delay_until_enough_samples(self):
+        tracker = LatencyTracker()
+        for _ in range(19):
+            tracker.add(0.1)
+        self.assertEqual(hedge_delay(tracker), 3)
+
+        tracker.add(0.1)
+        self.assertEqual(hedge_delay(tracker), 0.1)
+
+    def test_percentile(self):
+        tracker = LatencyTracker()
+        for duration in range(1, 101):
+            tracker.add(duration)
+        self.assertEqual(tracker.percentile(0.95), 95)
@@ -0,0 +1,140 @@
+import multiprocessing
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from api import cache as shared
+from api.cache_backends import SQLiteCache, cache_settings
+
+# Forked children inherit the configured settings and test overrides
+fork = multiprocessing.get_context("fork")
+
+
+def increment(path, times):
+    backend = SQLiteCache(path, {})
+    for _ in range(times):
+        backend.incr("hits")
+
+
+def try_add(path, results):
+    results.put(SQLiteCache(path, {}).add("lock", "taken", 60))
+
+
+def bump(namespace):
+    shared.bump_version(namespace)
+
+
+class SharedCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = str(Path(directory) / "cache.sqlite3")
+
+    def run_processes(self, target, *args, count=4):
+        processes = [fork.Process(target=target, args=args) for _ in range(count)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(30)
+            self.assertEqual(process.exitcode, 0)
+
+
+class SQLiteCacheTests(SharedCacheTestCase):
+    def test_incr_is_atomic_across_processes(self):
+        backend = SQLiteCache(self.path, {})
+        backend.set("hits", 0)
+        self.run_processes(increment, self.path, 50)
+        self.assertEqual(backend.get("hits"), 200)
+
+    def test_add_is_atomic_across_processes(self):
+        results = fork.Queue()
+        self.run_processes(try_add, self.path, results)
+        added = [results.get(timeout=5) for _ in range(4)]
+        self.assertEqual(added.count(True), 1)
+
+    def test_incr_of_missing_key(self):
+        with self.assertRaises(ValueError):
+            SQLiteCache(self.path, {}).incr("missing")
+
+    def test_expired_entries(self):
+        backend = SQLiteCache(self.path, {})
+        backend.set("gone", "value", 0.01)
+        time.sleep(0.05)
+        self.assertIsNone(backend.get("gone"))
+        self.assertTrue(backend.add("gone", "again"))
+
+    def test_values(self):
+        backend = SQLiteCache(self.path, {})
+        for value in (1, -5, 2**70, "text", [1, "two"], None, {"a": 1}):
+            backend.set("key", value)
+            self.assertEqual(backend.get("key", "default"), value)
+
+
+class CacheSettingsTests(SimpleTestCase):
+    def test_urls(self):
+        self.assertEqual(
+            cache_settings("sqlite:////var/cache/app.sqlite3")["LOCATION"],
+            "/var/cache/app.sqlite3",
+        )
+        self.assertEqual(
+            cache_settings("sqlite:///cache.sqlite3")["LOCATION"], "cache.sqlite3"
+        )
+        self.assertEqual(
+            cache_settings("redis://localhost:6379/1")["BACKEND"],
+            "django.core.cache.backends.redis.RedisCache",
+        )
+        self.assertEqual(cache_settings("locmem://")["LOCATION"], "unique-snowflake")
+        with self.assertRaises(ValueError):
+            cache_settings("memcached://localhost")
+
+
+class VersionPropagationTests(SharedCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        override = override_settings(
+            CACHES={"default": cache_settings(f"sqlite:///{self.path}")},
+            CACHE_VERSION_CHECK_INTERVAL=0.2,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shared._versions.clear)
+        shared._versions.clear()
+
+    def test_bump_in_another_process_is_seen(self):
+        version = shared.get_version("articles")
+        self.run_processes(bump, "articles", count=1)
+
+        # Read again only once the check interval has passed
+        self.assertEqual(shared.get_version("articles"), version)
+        time.sleep(0.3)
+        self.assertEqual(shared.get_version("articles"), version + 1)
+
+    def test_concurrent_bumps_are_all_counted(self):
+        version = shared.get_version("catalog")
+        self.run_processes(bump, "catalog")
+        self.assertEqual(caches["default"].get("version:catalog"), version + 4)
+
+    def test_versioned_entries(self):
+        loads = []
+
+        def loader():
+            loads.append(1)
+            return len(loads)
+
+        self.assertEqual(shared.get_or_load_versioned("catalog", "x", loader, 60), 1)
+        self.assertEqual(shared.get_or_load_versioned("catalog", "x", loader, 60), 1)
+        shared.bump_version("catalog")
+        self.assertEqual(shared.get_or_load_versioned("catalog", "x", loader, 60), 2)
+
+    def test_lru_cache_shares_entries(self):
+        first = shared.LRUCache("answers", 1024, shared_timeout=60)
+        second = shared.LRUCache("answers", 1024, shared_timeout=60)
+        first.set("question", "answer")
+        self.assertEqual(second.get("question"), "answer")
+        first.delete("question")
+        second.clear()
+        self.assertIsNone(second.get("question"))
@@ -0,0 +1,61 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from api.cache import _versions, get_version
+from api.models import (
+    AiData,
+    Category,
+    Client,
+    Conversation,
+    DailyUsageRollup,
+    Message,
+)
+
+
+class CatalogVersionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        _versions.clear()
+        self.addCleanup(_versions.clear)
+
+    def assertBumpedOnCommit(self, change):
+        version = get_version("catalog")
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+            _versions.clear()
+            self.assertEqual(get_version("catalog"), version)
+        _versions.clear()
+        self.assertGreater(get_version("catalog"), version)
+
+    def test_category_save(self):
+        self.assertBumpedOnCommit(lambda: Category.objects.create(name="Sport"))
+
+    def test_article_save(self):
+        self.assertBumpedOnCommit(
+            lambda: AiData.objects.create(heading="Sarlavha", content="Matn")
+        )
+
+    def test_article_categories(self):
+        article = AiData.objects.create(heading="Sarlavha", content="Matn")
+        category = Category.objects.create(name="Sport")
+        self.assertBumpedOnCommit(lambda: article.categories.add(category))
+
+
+class MessageSignalTests(TestCase):
+    def test_client_is_read_once_with_the_conversation(self):
+        client = Client.objects.create(external_id="signals-test", is_muhbir=True)
+        conversation = Conversation.objects.create(client=client)
+
+        message = Message(
+            conversation_id=conversation.id, sender="client", content="Salom"
+        )
+        with CaptureQueriesContext(connection) as queries:
+            message.save()
+
+        # The history, then the conversation joined with its client
+        selects = [q["sql"] for q in queries if q["sql"].startswith("SELECT")]
+        self.assertEqual(len(selects), 2)
+        self.assertIn('JOIN "api_client"', selects[1])
+        self.assertTrue(DailyUsageRollup.objects.get(sender="client").is_muhbir)
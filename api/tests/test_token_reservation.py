@@ -0,0 +1,136 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from api.models import APIKey, UsageLimit, tokens_counter
+from api.tokenizer import count_tokens
+
+CONVERSATION_URL = "/daryo-api/api/v1/ai/conversation/"
+
+
+class TokenCounterTestCase(TestCase):
+    def setUp(self):
+        # Live counters are kept in the cache and outlive the test transaction
+        cache.clear()
+        self.addCleanup(tokens_counter.flush)
+
+
+class TokenReservationTests(TokenCounterTestCase):
+    def test_reservation_is_counted_and_settled_to_the_real_usage(self):
+        api_key = APIKey.objects.create(token_limit=1000)
+
+        reservation = api_key.reserve_tokens(500)
+        self.assertIsNotNone(reservation)
+        self.assertEqual(api_key.remaining_tokens(), 500)
+
+        reservation.settle(120)
+        self.assertEqual(api_key.remaining_tokens(), 880)
+
+    def test_only_the_first_settlement_counts(self):
+        api_key = APIKey.objects.create(token_limit=1000)
+        reservation = api_key.reserve_tokens(500)
+        reservation.settle(120)
+        reservation.settle(300)
+        reservation.release()
+        self.assertEqual(api_key.remaining_tokens(), 880)
+
+    def test_release_gives_the_tokens_back(self):
+        api_key = APIKey.objects.create(token_limit=1000)
+        api_key.reserve_tokens(500).release()
+        self.assertEqual(api_key.remaining_tokens(), 1000)
+
+    def test_reservation_over_the_limit_is_refused(self):
+        api_key = APIKey.objects.create(token_limit=1000, tokens_used=700)
+        self.assertIsNone(api_key.reserve_tokens(500))
+        self.assertEqual(api_key.remaining_tokens(), 300)
+
+    def test_keys_without_limit_are_counted(self):
+        api_key = APIKey.objects.create(token_limit=0)
+        api_key.reserve_tokens(500).settle(42)
+        self.assertEqual(tokens_counter.value(api_key.pk), 42)
+
+    def test_concurrent_reservations_stay_within_the_limit(self):
+        api_key = APIKey.objects.create(token_limit=1000)
+        # Seed the live counter here, the threads only use the cache
+        tokens_counter.value(api_key.pk)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            reservations = list(
+                executor.map(lambda _: api_key.reserve_tokens(100), range(20))
+            )
+        self.assertEqual(sum(r is not None for r in reservations), 10)
+        self.assertEqual(api_key.remaining_tokens(), 0)
+
+    def test_usage_is_flushed_to_the_database(self):
+        api_key = APIKey.objects.create(token_limit=1000)
+        api_key.reserve_tokens(500).settle(120)
+        tokens_counter.flush()
+        api_key.refresh_from_db()
+        self.assertEqual(api_key.tokens_used, 120)
+
+
+@override_settings(TOKEN_RESERVATION_ESTIMATE=500, HISTORY_ALLOWED=False)
+class ConversationReservationTests(TokenCounterTestCase):
+    def setUp(self):
+        super().setUp()
+        UsageLimit.objects.create(is_muhbir=False, daily_limit=100)
+
+    def post(self, api_key, message="Salom", url=CONVERSATION_URL):
+        return self.client.post(
+            url,
+            {"external_id": "reservation-test", "name": "Test", "message": message},
+            content_type="application/json",
+            headers={"X-API-KEY": api_key.key},
+        )
+
+    def test_answer_settles_the_reservation(self):
+        api_key = APIKey.objects.create(token_limit=1000)
+        with mock.patch("api.views.get_ai_response", return_value=("Javob", 30, 12)):
+            response = self.post(api_key)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(api_key.remaining_tokens(), 1000 - 42)
+
+    def test_failed_answer_releases_the_reservation(self):
+        api_key = APIKey.objects.create(token_limit=1000)
+        with mock.patch("api.views.get_ai_response", side_effect=RuntimeError):
+            response = self.post(api_key)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(api_key.remaining_tokens(), 1000)
+
+    def test_exhausted_budget_is_refused(self):
+        api_key = APIKey.objects.create(token_limit=1000, tokens_used=800)
+        with mock.patch("api.views.get_ai_response") as get_ai_response:
+            response = self.post(api_key)
+        self.assertEqual(response.status_code, 403)
+        get_ai_response.assert_not_called()
+        self.assertEqual(api_key.remaining_tokens(), 200)
+
+    def test_finished_stream_settles_the_reservation(self):
+        api_key = APIKey.objects.create(token_limit=1000)
+        with mock.patch(
+            "api.views.get_ai_response_stream", return_value=(iter(["Ja", "vob"]), 30, False)
+        ):
+            response = self.post(api_key, url=CONVERSATION_URL + "?stream=1")
+            b"".join(response.streaming_content)
+        self.assertEqual(
+            api_key.remaining_tokens(), 1000 - 30 - count_tokens("Javob") - 6
+        )
+
+    def test_stream_closed_before_it_started_releases_the_reservation(self):
+        api_key = APIKey.objects.create(token_limit=1000)
+        with mock.patch("api.views.get_ai_response_stream") as get_ai_response_stream:
+            response = self.post(api_key, url=CONVERSATION_URL + "?stream=1")
+            self.assertEqual(api_key.remaining_tokens(), 500)
+            response.close()
+        get_ai_response_stream.assert_not_called()
+        self.assertEqual(api_key.remaining_tokens(), 1000)
+
+    def test_cached_stream_costs_nothing(self):
+        api_key = APIKey.objects.create(token_limit=1000)
+        with mock.patch(
+            "api.views.get_ai_response_stream", return_value=(iter(["Javob"]), 0, True)
+        ):
+            response = self.post(api_key, url=CONVERSATION_URL + "?stream=1")
+            b"".join(response.streaming_content)
+        self.assertEqual(api_key.remaining_tokens(), 1000)
@@ -0,0 +1,49 @@
+from io import StringIO
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from api.models import AiData
+from api.tokenizer import RegexTokenizer, count_tokens, get_tokenizer
+
+
+class ConfiguredTokenizer:
+    name = "configured"
+
+    def count(self, text):
+        return len(text)
+
+
+class GetTokenizerTests(SimpleTestCase):
+    def setUp(self):
+        get_tokenizer.cache_clear()
+        self.addCleanup(get_tokenizer.cache_clear)
+
+    def test_default_is_local(self):
+        self.assertIsInstance(get_tokenizer(), RegexTokenizer)
+
+    @override_settings(TOKENIZER="api.tests.test_tokenizer.ConfiguredTokenizer")
+    def test_configured_tokenizer(self):
+        self.assertEqual(count_tokens("salom"), 5)
+
+    @override_settings(TOKENIZER="api.tokenizer.MissingTokenizer")
+    def test_unavailable_tokenizer_is_an_error(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_tokenizer()
+
+
+class RecountTokensTests(TestCase):
+    def setUp(self):
+        self.addCleanup(get_tokenizer.cache_clear)
+
+    def test_articles_are_recounted(self):
+        article = AiData.objects.create(heading="Sarlavha", content="Matn")
+        with override_settings(
+            TOKENIZER="api.tests.test_tokenizer.ConfiguredTokenizer"
+        ):
+            get_tokenizer.cache_clear()
+            call_command("recount_tokens", stdout=StringIO())
+        article.refresh_from_db()
+        self.assertEqual(article.heading_tokens, 8)
+        self.assertEqual(article.content_tokens, 4)
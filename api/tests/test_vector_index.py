@@ -0,0 +1,136 @@
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+from django.core.cache import cache as default_cache
+from django.test import SimpleTestCase, override_settings
+
+from api import cache, retrieval
+from api.retrieval import HashingEmbedder, VectorIndex, get_embedder
+
+ARTICLES = [
+    (1, "Toshkentda ob-havo", "Ertaga Toshkentda yomg'ir yog'adi."),
+    (2, "Futbol", "Milliy terma jamoa o'yinda g'alaba qozondi."),
+    (3, "Valyuta kursi", "Dollar kursi bugun biroz oshdi."),
+]
+
+
+class VectorIndexSaveLoadTests(SimpleTestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.directory = self.root / "vector_index"
+        self.embedder = HashingEmbedder(dim=64)
+
+        self.index = VectorIndex(self.embedder)
+        self.index.build(ARTICLES, version=7)
+        self.index.save(self.directory)
+
+    def load(self, embedder=None):
+        index = VectorIndex(embedder or self.embedder)
+        return index, index.load(self.directory)
+
+    def test_round_trip(self):
+        index, loaded = self.load()
+        self.assertTrue(loaded)
+        self.assertEqual(index.version, 7)
+        np.testing.assert_array_equal(index.ids, self.index.ids)
+        np.testing.assert_allclose(index.matrix, self.index.matrix)
+        self.assertEqual(index.search("futbol o'yinda")[0][0], 2)
+
+    def test_save_replaces_previous_snapshot(self):
+        first = self.directory.resolve()
+        self.index.add(4, "Yangi maqola", "Matn")
+        self.index.save(self.directory)
+
+        self.assertNotEqual(self.directory.resolve(), first)
+        self.assertFalse(first.exists())
+        index, loaded = self.load()
+        self.assertTrue(loaded)
+        self.assertEqual(len(index), 4)
+
+    def test_legacy_directory_is_replaced(self):
+        shutil.rmtree(self.directory.resolve())
+        self.directory.unlink()
+        self.directory.mkdir()
+        (self.directory / "meta.json").write_text("{}")
+
+        self.index.save(self.directory)
+        self.assertTrue(self.directory.is_symlink())
+        self.assertTrue(self.load()[1])
+
+    def test_corrupted_ids_are_rejected(self):
+        np.save(self.directory / "ids.npy", np.arange(2, dtype=np.int64))
+        with self.assertLogs("daryo-api", "WARNING"):
+            index, loaded = self.load()
+        self.assertFalse(loaded)
+        self.assertEqual(len(index), 0)
+        self.assertIsNone(index.version)
+
+    def test_count_mismatch_is_rejected(self):
+        meta_path = self.directory / "meta.json"
+        meta = json.loads(meta_path.read_text())
+        meta["count"] = 5
+        meta_path.write_text(json.dumps(meta))
+        with self.assertLogs("daryo-api", "WARNING"):
+            self.assertFalse(self.load()[1])
+
+    def test_truncated_vectors_are_rejected(self):
+        vectors = self.directory / "vectors.npy"
+        vectors.write_bytes(vectors.read_bytes()[:100])
+        self.assertFalse(self.load()[1])
+
+    def test_other_embedder_is_rejected(self):
+        self.assertFalse(self.load(HashingEmbedder(dim=32))[1])
+
+    def test_missing_index(self):
+        shutil.rmtree(self.root)
+        self.assertFalse(self.load()[1])
+
+
+class RefreshVectorIndexTests(SimpleTestCase):
+    def setUp(self):
+        default_cache.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        override = override_settings(VECTOR_INDEX_DIR=str(Path(directory) / "index"))
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(retrieval.vector_index_ready.clear)
+        self.addCleanup(retrieval.set_vector_index, None)
+        retrieval.vector_index = None
+
+        index = VectorIndex(get_embedder())
+        index.build(ARTICLES, version=cache.get_version("articles"))
+        index.save(Path(directory) / "index")
+
+    @override_settings(RETRIEVAL_INDEX_MAX_AGE=-1)
+    def test_old_saved_index_is_used_while_another_process_builds(self):
+        cache.add("lock", "vector_index", "other", 60)
+        retrieval.refresh_vector_index()
+        self.assertEqual(len(retrieval.vector_index), 3)
+        self.assertEqual(cache.lookup("lock", "vector_index"), "other")
+
+    @override_settings(RETRIEVAL_INDEX_MAX_AGE=-1)
+    def test_lock_taken_over_by_another_process_is_kept(self):
+        original = VectorIndex.build
+
+        def build(index, rows, version):
+            # The lock expired during the build and another process took it
+            cache.store("lock", "vector_index", "other", 60)
+            original(index, ARTICLES, version)
+
+        with mock.patch.object(VectorIndex, "build", autospec=True, side_effect=build):
+            retrieval.refresh_vector_index()
+        self.assertEqual(cache.lookup("lock", "vector_index"), "other")
+        self.assertEqual(len(retrieval.vector_index), 3)
+
+    def test_lock_is_released_after_the_build(self):
+        shutil.rmtree(Path(retrieval.settings.VECTOR_INDEX_DIR).resolve())
+        with mock.patch.object(retrieval, "article_rows", return_value=ARTICLES):
+            retrieval.refresh_vector_index()
+        self.assertIsNone(cache.lookup("lock", "vector_index"))
+        self.assertEqual(len(retrieval.vector_index), 3)
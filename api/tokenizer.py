@@ -0,0 +1,86 @@
+import math
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+# Pieces a byte-level BPE never merges across: letter runs, groups of up to
+# three digits, single other characters. Whitespace is folded into the next piece.
+PIECE_RE = re.compile(r"[^\W\d_]+|\d{1,3}|[^\w\s]|_", re.UNICODE)
+
+
+class RegexTokenizer:
+    """
+    Dependency-free token estimate modelled on byte-level BPE vocabularies:
+    text is split the way those tokenizers pre-split it and each piece is
+    counted by script. Latin words are mostly single tokens or split in a few
+    pieces, while Cyrillic words and emoji, which take several UTF-8 bytes
+    per character, cost noticeably more than `len(text) // 4` suggests.
+
+    The characters per token are rough guesses, not calibrated against a
+    real vocabulary, so counts can be off by a good margin either way. It is
+    the default, as it needs no download.
+    """
+
+    name = "regex"
+
+    def __init__(self, latin_chars=5, other_chars=3):
+        self.latin_chars = latin_chars
+        self.other_chars = other_chars
+
+    def count(self, text):
+        tokens = 0
+        for piece in PIECE_RE.findall(text):
+            if piece.isascii():
+                if piece[0].isalpha():
+                    tokens += math.ceil(len(piece) / self.latin_chars)
+                else:
+                    tokens += 1
+            elif piece[0].isalpha():
+                tokens += math.ceil(len(piece) / self.other_chars)
+            else:
+                # emoji and other symbols: about one token per two UTF-8 bytes
+                tokens += max(1, len(piece.encode("utf-8")) // 2)
+        return tokens
+
+
+class TiktokenTokenizer:
+    """
+    Exact counts with a tiktoken BPE vocabulary (optional dependency, not in
+    requirements). Set TIKTOKEN_CACHE_DIR to a directory holding the
+    vocabulary file to load it without network access. Run the recount_tokens
+    command after switching to it.
+    """
+
+    def __init__(self, encoding="o200k_base"):
+        import tiktoken
+
+        self.name = encoding
+        self._encoding = tiktoken.get_encoding(encoding)
+
+    def count(self, text):
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer():
+    """
+    Return the tokenizer configured by settings.TOKENIZER: any object with
+    a `count(text)` method returning the number of tokens. Loaded once per
+    process when the app starts (see ApiConfig.ready), so a tokenizer that
+    cannot be loaded stops the process instead of counting on another scale.
+    """
+    try:
+        return import_string(settings.TOKENIZER)()
+    except Exception as e:
+        raise ImproperlyConfigured(
+            f"Tokenizer {settings.TOKENIZER} cannot be loaded: {e!r}"
+        ) from e
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    return get_tokenizer().count(text)
@@ -1,8 +1,19 @@
 from django.urls import path
-from .views import ClientConversationView, AiDataCreateView
+from .views import (
+    ClientConversationView,
+    AsyncClientConversationView,
+    AiDataCreateView,
+    AiDataBulkCreateView,
+)
 
 
 urlpatterns = [
     path("ai/conversation/", ClientConversationView.as_view()),
+    path("ai/conversation/async/", AsyncClientConversationView.as_view()),
     path("api/ai-data/", AiDataCreateView.as_view(), name="ai-data-create"),
+    path(
+        "api/ai-data/bulk/",
+        AiDataBulkCreateView.as_view(),
+        name="ai-data-bulk-create",
+    ),
 ]
@@ -1,9 +1,29 @@
+import hashlib
 import os
+import unicodedata
 
-from openai import OpenAI
+from asgiref.sync import sync_to_async
+from django.conf import settings
 import google.generativeai as genai
 from dotenv import load_dotenv
 from .models import AiData, Category, Conversation
+from .hedging import AsyncHedged, Hedged
+from .providers import (
+    async_openai_client,
+    gemini_model,
+    gemini_request_options,
+    openai_client,
+)
+from .cache import (
+    LRUCache,
+    get_or_load_versioned,
+    get_version,
+    lookup,
+    record,
+    store,
+)
+from .retrieval import WORD_RE, get_lexical_index, get_vector_index
+from .tokenizer import count_tokens
 
 load_dotenv()
 
@@ -11,7 +31,9 @@ import os
 
 genai.configure(api_key=os.getenv("gemini-token"))
 
-client = OpenAI(api_key=os.getenv("gpt_token"))
+# Long-lived, pooled clients, see api.providers
+client = openai_client()
+async_client = async_openai_client()
 
 content = """\n 
 you are well taught assistant of 'Daryo' news company, you must  newer tell who you are really
@@ -55,20 +77,43 @@ here is is info you should know and answer from:\n
 
 def ai_gemini(content: str, user_message: str):
 
-    model = genai.GenerativeModel(
-        model_name="gemini-1.5-flash-latest",
-        generation_config=genai.types.GenerationConfigDict(
-            {"temperature": 0.7, "max_output_tokens": 500}
-        ),
-        system_instruction=content,
-    )
+    model = gemini_model(content)
     response = model.generate_content(
-        user_message,
+        user_message, request_options=gemini_request_options()
     )
 
     return response.text
 
 
+async def ai_gemini_async(content: str, user_message: str):
+
+    model = gemini_model(content)
+    response = await model.generate_content_async(
+        user_message, request_options=gemini_request_options()
+    )
+
+    return response.text
+
+
+def ai_gemini_stream(content: str, user_message: str):
+    """
+    Yield the answer in chunks as the model generates it.
+    """
+    model = gemini_model(content)
+    response = model.generate_content(
+        user_message, stream=True, request_options=gemini_request_options()
+    )
+
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            # Chunks without text parts (e.g. the final one with the finish reason)
+            continue
+        if text:
+            yield text
+
+
 def ai_gpt(content, user_message):
 
     completion = client.chat.completions.create(
@@ -85,24 +130,68 @@ def ai_gpt(content, user_message):
     return ai_response.content
 
 
-from api.ai.gemini_function import get_id_gemin
-from api.ai.gpt_function import get_id_gpt
+def ai_gpt_stream(content, user_message):
+    """
+    Yield the answer in chunks as the model generates it.
+    """
+    stream = client.chat.completions.create(
+        model="gpt-4o-mini",
+        temperature=0.4,
+        max_tokens=500,
+        messages=[
+            {"role": "system", "content": content},
+            {"role": "user", "content": user_message},
+        ],
+        stream=True,
+    )
+
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def ai_gpt_async(content, user_message):
+
+    completion = await async_client.chat.completions.create(
+        model="gpt-4o-mini",
+        temperature=0.4,
+        max_tokens=500,
+        messages=[
+            {"role": "system", "content": content},
+            {"role": "user", "content": user_message},
+        ],
+    )
+
+    ai_response = completion.choices[0].message
+    return ai_response.content
+
+
+from api.ai.gemini_function import get_id_gemin, get_id_gemin_async
+from api.ai.gpt_function import get_id_gpt, get_id_gpt_async
 
 ai = ai_gemini
+ai_stream = ai_gemini_stream
 get_id = get_id_gemin
+ai_async = ai_gemini_async
+get_id_async = get_id_gemin_async
+
+if settings.LLM_HEDGING:
+    # Ask GPT as well when Gemini is slower than usual, see api.hedging
+    ai = Hedged(ai_gemini, ai_gpt)
+    get_id = Hedged(get_id_gemin, get_id_gpt)
+    ai_async = AsyncHedged(ai_gemini_async, ai_gpt_async)
+    get_id_async = AsyncHedged(get_id_gemin_async, get_id_gpt_async)
 import logging
 
 # Get the custom logger
 logger = logging.getLogger("daryo-api")
 
 
-def chooseOne(user_message):
-    global content
-
-    permanent_content = content
-    token_used = len(permanent_content)
-
-    content_for_chooser = (
+def category_chooser_prompt():
+    """
+    System instruction asking the model to pick the id of the category of the question.
+    """
+    return (
         """
     your main and only goal is to choose relative data category  
     and return it's id the number only id number not any other characters only the id number e.g like id:(0) you shoulld return the number '0' only inside, dont return other thing just id of choosen category if doesnt exists 
@@ -111,7 +200,49 @@ def chooseOne(user_message):
     """
         + Category.getAllCategories()
     )
-    token_used += len(content_for_chooser)
+
+
+def heading_chooser_prompt(category_id):
+    """
+    System instruction asking the model to pick the id of the article answering the question.
+    """
+    return """
+        your main and only goal is to choose relative data heading  
+        and returning it's id the number only id number not any other characters only the id number e.g like id:(0) you shoulld return the number 0 only inside, dont return other thing just id of choosen heading if doesnt exists 
+        then you can return id which is similiar or relative to question in the worst the worst case return the relative similiar id , you must return only number not other thing in any case here are the 
+        headings from which yous should choose, data will be in "id:({data.id})-heading:({data.heading});" format here are they:::
+        """ + AiData.getAllHeadingsByCat(
+        category_id
+    )
+
+
+def prompt_tokens(prompt):
+    """
+    Tokens of a system prompt. Prompts only change with the catalog, so
+    counts are cached under its version instead of re-counting on every request.
+    """
+    return get_or_load_versioned(
+        "catalog",
+        f"prompt_tokens:{hashlib.md5(prompt.encode('utf-8')).hexdigest()}",
+        lambda: count_tokens(prompt),
+        settings.CATALOG_CACHE_TTL,
+    )
+
+
+def chooseOne(user_message):
+    """
+    Ask the model for the category and then the article the question is about.
+    Returns the system prompt with the article, its token estimate and the
+    articles used.
+    """
+    global content
+
+    permanent_content = content
+    token_used = prompt_tokens(content)
+    articles = []
+
+    content_for_chooser = category_chooser_prompt()
+    token_used += prompt_tokens(content_for_chooser)
 
     data_smth = get_id(content_for_chooser, user_message)
 
@@ -120,89 +251,269 @@ def chooseOne(user_message):
     logger.info(f"category-id: {data_smth}, category instance: {category}\n")
     if category is not None:
 
-        content_for_chooser = """
-        your main and only goal is to choose relative data heading  
-        and returning it's id the number only id number not any other characters only the id number e.g like id:(0) you shoulld return the number 0 only inside, dont return other thing just id of choosen heading if doesnt exists 
-        then you can return id which is similiar or relative to question in the worst the worst case return the relative similiar id , you must return only number not other thing in any case here are the 
-        headings from which yous should choose, data will be in "id:({data.id})-heading:({data.heading});" format here are they:::
-        """ + AiData.getAllHeadingsByCat(
-            category.id
-        )
-        token_used += len(content_for_chooser)
+        content_for_chooser = heading_chooser_prompt(category.id)
+        token_used += prompt_tokens(content_for_chooser)
         data_smth = get_id(content_for_chooser, user_message)
 
         aidata = AiData.getData(data_smth)
         logger.info(f"AI data id: {data_smth}, aidata: {aidata}\n")
         if aidata is not None:
-            token_used += len(aidata.content)
+            token_used += aidata.content_tokens
 
             permanent_content += aidata.content
+            articles.append(aidata)
 
-    return permanent_content, token_used // 4
+    return permanent_content, token_used, articles
 
 
-from django.conf import settings
+async def achooseOne(user_message):
+    """
+    Async version of chooseOne, the provider calls do not block a worker thread.
+    """
+    permanent_content = content
+    token_used = await sync_to_async(prompt_tokens)(content)
+    articles = []
+
+    content_for_chooser = await sync_to_async(category_chooser_prompt)()
+    token_used += await sync_to_async(prompt_tokens)(content_for_chooser)
+
+    data_smth = await get_id_async(content_for_chooser, user_message)
+
+    category = await sync_to_async(Category.getData)(data_smth)
+
+    logger.info(f"category-id: {data_smth}, category instance: {category}\n")
+    if category is not None:
+
+        content_for_chooser = await sync_to_async(heading_chooser_prompt)(category.id)
+        token_used += await sync_to_async(prompt_tokens)(content_for_chooser)
+        data_smth = await get_id_async(content_for_chooser, user_message)
+
+        aidata = await sync_to_async(AiData.getData)(data_smth)
+        logger.info(f"AI data id: {data_smth}, aidata: {aidata}\n")
+        if aidata is not None:
+            token_used += aidata.content_tokens
+
+            permanent_content += aidata.content
+            articles.append(aidata)
+
+    return permanent_content, token_used, articles
+
+
+def choose_from_index(index, user_message):
+    """
+    Choose the articles for the question with a local index (api.retrieval),
+    without asking the model to pick a category and heading.
+    """
+    permanent_content = content
+    token_used = prompt_tokens(content)
+    articles = []
+
+    matches = index.search(user_message, k=settings.RETRIEVAL_TOP_K)
+    logger.info(f"{type(index).__name__} matches: {matches}\n")
+    for article_id, score in matches:
+        aidata = AiData.getData(article_id)
+        if aidata is not None:
+            token_used += aidata.content_tokens
+
+            permanent_content += aidata.content
+            articles.append(aidata)
+
+    return permanent_content, token_used, articles
+
+
+def chooseBM25(user_message):
+    return choose_from_index(get_lexical_index(), user_message)
+
+
+def chooseVector(user_message):
+    index = get_vector_index()
+    if index is None:
+        # Still being loaded or built, see get_vector_index
+        index = get_lexical_index()
+    return choose_from_index(index, user_message)
 
 
-def get_ai_response(user_message, user_history):
+# Ways of choosing the article(s) an answer is based on, see settings.RETRIEVAL_STRATEGY
+retrieval_strategies = {
+    "llm": chooseOne,
+    "bm25": chooseBM25,
+    "vector": chooseVector,
+}
 
-    permanent_data, token_used_input = chooseOne(user_message)
+
+def choose_content(user_message, strategy=None):
+    return retrieval_strategies[strategy or settings.RETRIEVAL_STRATEGY](user_message)
+
+
+async def achoose_content(user_message, strategy=None):
+    strategy = strategy or settings.RETRIEVAL_STRATEGY
+    if strategy == "llm":
+        return await achooseOne(user_message)
+    # Local strategies only do CPU work and database reads
+    return await sync_to_async(retrieval_strategies[strategy])(user_message)
+
+
+# Answers to questions asked without earlier turns, see lookup_answer
+answer_cache = LRUCache(
+    "answers", settings.ANSWER_CACHE_MAX_BYTES, shared_timeout=settings.CATALOG_CACHE_TTL
+)
+
+
+def normalize_question(text):
+    """
+    Reduce a question to its words, so case, spacing and punctuation do not matter.
+    """
+    return " ".join(WORD_RE.findall(unicodedata.normalize("NFKC", text).casefold()))
+
+
+def prompt_version():
+    """
+    Identifies the system prompt and answering model; answers cached under
+    another version are not reused.
+    """
+    return hashlib.md5(f"{ai.__name__}:{content}".encode("utf-8")).hexdigest()[:12]
+
+
+def _selection_key(question, strategy):
+    return f"{get_version('catalog')}:{strategy}:{question}"
+
+
+def _answer_key(question, articles):
+    article_versions = tuple(
+        (article.id, hashlib.md5(article.content.encode("utf-8")).hexdigest())
+        for article in articles
+    )
+    return (question, article_versions, prompt_version())
+
+
+def lookup_answer(user_message, strategy):
+    """
+    Return the cached answer to the question, or None. The articles chosen for
+    the question are remembered until the catalog changes; the answer itself is
+    keyed by the question, the ids and content hashes of those articles and
+    the prompt version, so it is never served for edited content.
+    """
+    question = normalize_question(user_message)
+    article_ids = lookup("answer_selection", _selection_key(question, strategy))
+    record("answer_selection", hit=article_ids is not None)
+    if article_ids is None:
+        return None
+
+    articles = [AiData.getData(article_id) for article_id in article_ids]
+    if None in articles:
+        return None
+    return answer_cache.get(_answer_key(question, articles))
+
+
+def remember_answer(user_message, strategy, articles, answer):
+    question = normalize_question(user_message)
+    store(
+        "answer_selection",
+        _selection_key(question, strategy),
+        [article.id for article in articles],
+        settings.CATALOG_CACHE_TTL,
+    )
+    answer_cache.set(_answer_key(question, articles), answer)
+
+
+def get_ai_response(user_message, user_history, strategy=None, cacheable=False):
+    """
+    Answer the question. With `cacheable` (no earlier turns in the history)
+    a cached answer to the same question is returned without calling the
+    model, and costs no tokens.
+    """
+    strategy = strategy or settings.RETRIEVAL_STRATEGY
+    if cacheable:
+        answer = lookup_answer(user_message, strategy)
+        if answer is not None:
+            return answer, 0, 0
+    question = user_message
+
+    permanent_data, token_used_input, articles = choose_content(user_message, strategy)
 
     if settings.HISTORY_ALLOWED:
 
         user_message = user_history
 
-    token_used_input += len(user_message) // 4
+    token_used_input += count_tokens(user_message)
 
     answer = ai(permanent_data, user_message)
-    token_used_output = (len(answer) // 4) + 6
+    token_used_output = count_tokens(answer) + 6
+
+    if cacheable:
+        remember_answer(question, strategy, articles, answer)
 
     return answer, token_used_input, token_used_output
 
 
-from functools import lru_cache
+def get_ai_response_stream(user_message, user_history, strategy=None, cacheable=False):
+    """
+    Like get_ai_response, but the answer is returned as an iterator of text
+    chunks, together with the number of input tokens and whether it is a
+    cached answer. The output tokens can be counted once the iterator is
+    exhausted; cached answers cost no tokens.
+    """
+    strategy = strategy or settings.RETRIEVAL_STRATEGY
+    if cacheable:
+        answer = lookup_answer(user_message, strategy)
+        if answer is not None:
+            return iter([answer]), 0, True
+    question = user_message
 
+    permanent_data, token_used_input, articles = choose_content(user_message, strategy)
 
-def token_size_calculate(user_history):
-    global content
+    if settings.HISTORY_ALLOWED:
 
-    length = len(content)
+        user_message = user_history
 
-    content_for_chooser = (
-        """
-    your main and only goal is to choose relative data category  
-    and returning it's id the number only id number not any other characters only the id number e.g like id:(0) you shoulld return the number 0 only inside, dont return other thing just id of choosen category if doesnt exists 
-    then you can return id which is similiar or relative to question in the worst the worst case return the relative similiar id , you must return only number not other thing in any case here are the 
-    headings from which yous should choose, data will be in "id:({data.id})-category:({data.category});" format here are they:::
-    """
-        + Category.getAllCategories()
-    )
+    token_used_input += count_tokens(user_message)
 
-    length += len(content_for_chooser)
+    chunks = ai_stream(permanent_data, user_message)
+    if cacheable:
+        chunks = _remember_streamed_answer(chunks, question, strategy, articles)
+    return chunks, token_used_input, False
 
-    content_for_chooser = """
-        your main and only goal is to choose relative data heading  
-        and returning it's id the number only id number not any other characters only the id number e.g like id:(0) you shoulld return the number 0 only inside, dont return other thing just id of choosen heading if doesnt exists 
-        then you can return id which is similiar or relative to question in the worst the worst case return the relative similiar id , you must return only number not other thing in any case here are the 
-        headings from which yous should choose, data will be in "id:({data.id})-heading:({data.heading});" format here are they:::
-        """
 
-    length += len(content_for_chooser)
+def _remember_streamed_answer(chunks, question, strategy, articles):
+    answer = []
+    for chunk in chunks:
+        answer.append(chunk)
+        yield chunk
+    remember_answer(question, strategy, articles, "".join(answer))
 
-    token_size = length // 4
 
-    token_size += Category.calculate_average_headings_token_by_cat()
-    token_size += AiData.getMeanContentLength() // 4
+async def aget_ai_response(user_message, user_history, strategy=None, cacheable=False):
+    strategy = strategy or settings.RETRIEVAL_STRATEGY
+    if cacheable:
+        answer = await sync_to_async(lookup_answer)(user_message, strategy)
+        if answer is not None:
+            return answer, 0, 0
+    question = user_message
+
+    permanent_data, token_used_input, articles = await achoose_content(
+        user_message, strategy
+    )
 
     if settings.HISTORY_ALLOWED:
-        token_size += len(user_history) // 4
 
-    return token_size
+        user_message = user_history
 
+    token_used_input += count_tokens(user_message)
 
-def avarage_request_token_size():
+    answer = await ai_async(permanent_data, user_message)
+    token_used_output = count_tokens(answer) + 6
+
+    if cacheable:
+        await sync_to_async(remember_answer)(question, strategy, articles, answer)
+
+    return answer, token_used_input, token_used_output
 
-    length = len(content)
+
+from functools import lru_cache
+
+
+def _catalog_token_size():
+    token_size = count_tokens(content)
 
     content_for_chooser = (
         """
@@ -214,7 +525,7 @@ def avarage_request_token_size():
         + Category.getAllCategories()
     )
 
-    length += len(content_for_chooser)
+    token_size += count_tokens(content_for_chooser)
 
     content_for_chooser = """
         your main and only goal is to choose relative data heading  
@@ -223,12 +534,37 @@ def avarage_request_token_size():
         headings from which yous should choose, data will be in "id:({data.id})-heading:({data.heading});" format here are they:::
         """
 
-    length += len(content_for_chooser)
-
-    token_size = length // 4
+    token_size += count_tokens(content_for_chooser)
 
     token_size += Category.calculate_average_headings_token_by_cat()
-    token_size += AiData.getMeanContentLength() // 4
+    token_size += AiData.getMeanContentTokens()
+
+    return token_size
+
+
+def catalog_token_size():
+    """
+    Estimated tokens of the prompts and catalog sent with every request,
+    cached until the catalog changes.
+    """
+    return get_or_load_versioned(
+        "catalog", "token_size", _catalog_token_size, settings.CATALOG_CACHE_TTL
+    )
+
+
+def token_size_calculate(user_history):
+
+    token_size = catalog_token_size()
+
+    if settings.HISTORY_ALLOWED:
+        token_size += count_tokens(user_history)
+
+    return token_size
+
+
+def avarage_request_token_size():
+
+    token_size = catalog_token_size()
     if settings.HISTORY_ALLOWED:
         token_size += Conversation.get_avarage_token_size_for_history()
 
@@ -1,12 +1,27 @@
+import base64
+import binascii
+import hashlib
+import json
+
+from asgiref.sync import sync_to_async
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.fields import DateTimeField
 from .models import Client, Conversation, Message
 from .serializers import ClientSerializer, MessageSerializer
-from .utils import get_ai_response
+from .tokenizer import count_tokens
+from .utils import aget_ai_response, get_ai_response, get_ai_response_stream
 
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.utils import timezone
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from django.utils.http import parse_etags, quote_etag
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 
 from django.conf import settings
 
@@ -16,6 +31,9 @@ class ClientConversationView(APIView):
     View to handle client login (based on external_id), conversation management, and message creation.
     """
 
+    # Methods that call the AI and need tokens reserved by APIKeyMiddleware
+    token_reservation_methods = ("POST",)
+
     def post(self, request):
 
         # Get client credentials and message from the request
@@ -33,13 +51,11 @@ class ClientConversationView(APIView):
 
         try:
             # Check if the client already exists
-            client, created = Client.objects.get_or_create(
+            client, created = Client.get_or_create_within_limit(
                 external_id=external_id, defaults={"name": name, "email": email}
             )
-            if created and settings.CLIENTS_COUNT < Client.objects.all().count():
-                # New client created
-                client_serializer = ClientSerializer(client)
-                client.delete()
+            if client is None:
+                # No room left under settings.CLIENTS_COUNT
                 return Response(
                     {"error": "You have exceeded the maximum allowed limit of users."},
                     status=status.HTTP_400_BAD_REQUEST,
@@ -78,7 +94,7 @@ class ClientConversationView(APIView):
         # Save the message to the conversation
         message_serializer = MessageSerializer(data=message_data)
         if message_serializer.is_valid():
-            message_serializer.save()
+            message_serializer.save(api_key=request.api_key)
         else:
             return Response(
                 message_serializer.errors, status=status.HTTP_400_BAD_REQUEST
@@ -89,14 +105,41 @@ class ClientConversationView(APIView):
             conversation_history = (
                 conversation.last_conversation_messages_str
             )  # Fetch the formatted history
+            # Answers only depend on the question when there are no earlier turns
+            cacheable = conversation.history_turns() <= 1
         else:
             conversation_history = ""
+            cacheable = True
+
+        if request.query_params.get("stream") in ("1", "true"):
+            # Send the answer as server-sent events while it is generated
+            usage = {"input": 0, "output": 0}
+            response = StreamingHttpResponse(
+                SettledStream(
+                    self.stream_answer(
+                        usage,
+                        request.api_key,
+                        conversation,
+                        user_message,
+                        conversation_history,
+                        cacheable,
+                    ),
+                    request.token_reservation,
+                    usage,
+                ),
+                content_type="text/event-stream",
+            )
+            response["Cache-Control"] = "no-cache"
+            response["X-Accel-Buffering"] = "no"  # do not let nginx buffer the stream
+            return response
 
         try:
             ai_response, token_input, token_output = get_ai_response(
-                user_message=user_message, user_history=conversation_history
+                user_message=user_message,
+                user_history=conversation_history,
+                cacheable=cacheable,
             )
-            request.api_key.use_tokens(token_input + token_output)
+            request.token_reservation.settle(token_input + token_output)
         except Exception as e:
             return Response(
                 {"error": f"An error occurred while getting AI response: {str(e)}"},
@@ -112,7 +155,9 @@ class ClientConversationView(APIView):
 
         ai_message_serializer = MessageSerializer(data=ai_message_data)
         if ai_message_serializer.is_valid():
-            ai_message_serializer.save()
+            ai_message_serializer.save(
+                api_key=request.api_key, input_tokens=token_input
+            )
         else:
             return Response(
                 ai_message_serializer.errors, status=status.HTTP_400_BAD_REQUEST
@@ -126,6 +171,53 @@ class ClientConversationView(APIView):
             status=status.HTTP_200_OK,
         )
 
+    def stream_answer(
+        self,
+        usage,
+        api_key,
+        conversation,
+        user_message,
+        conversation_history,
+        cacheable,
+    ):
+        """
+        Yield the AI answer as server-sent events: one "message" event per chunk,
+        then a "done" event with the full answer once it is stored, or an
+        "error" event. The tokens used are recorded in `usage` for
+        SettledStream, also when the client disconnects early.
+        """
+        answer = []
+        cached = False
+        try:
+            chunks, token_input, cached = get_ai_response_stream(
+                user_message=user_message,
+                user_history=conversation_history,
+                cacheable=cacheable,
+            )
+            usage["input"] = token_input
+            for chunk in chunks:
+                answer.append(chunk)
+                yield sse_event({"text": chunk})
+
+            ai_response = "".join(answer)
+            Message.objects.create(
+                conversation=conversation,
+                sender="ai",
+                content=ai_response,
+                api_key=api_key,
+                input_tokens=token_input,
+            )
+            yield sse_event({"response": ai_response}, event="done")
+        except Exception as e:
+            yield sse_event(
+                {"error": f"An error occurred while getting AI response: {str(e)}"},
+                event="error",
+            )
+        finally:
+            # Cached answers cost no tokens, as in get_ai_response
+            if answer and not cached:
+                usage["output"] = count_tokens("".join(answer)) + 6
+
     def get(self, request):
         # Get the client based on external_id provided in query parameters
         external_id = request.query_params.get("external_id")
@@ -164,20 +256,244 @@ class ClientConversationView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Get all messages related to the conversation
-        messages = Message.objects.filter(conversation=conversation).order_by(
-            "timestamp"
+        try:
+            limit = min(
+                int(request.query_params.get("limit", settings.MESSAGES_PAGE_SIZE)),
+                settings.MESSAGES_PAGE_SIZE_MAX,
+            )
+            before = decode_cursor(request.query_params.get("before"))
+            after = decode_cursor(request.query_params.get("after"))
+        except ValueError:
+            return Response(
+                {"error": "Invalid limit or cursor."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if limit < 1 or (before and after):
+            return Response(
+                {"error": "limit must be positive, use either before or after."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        messages = Message.objects.filter(conversation=conversation)
+
+        # Messages are only ever added, so the newest one identifies the state
+        # of the conversation; polling clients get a 304 until a message arrives
+        newest = (
+            messages.order_by("-timestamp", "-id").values_list("id", flat=True).first()
+        )
+        etag = quote_etag(
+            hashlib.md5(f"{newest}:{request.get_full_path()}".encode()).hexdigest()
         )
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            response["ETag"] = etag
+            return response
+
+        # Keyset pagination on (timestamp, id), one page of plain rows
+        fields = ("id", "conversation", "sender", "content", "timestamp")
+        if after:
+            page = list(
+                messages.filter(
+                    Q(timestamp__gt=after[0]) | Q(timestamp=after[0], id__gt=after[1])
+                )
+                .order_by("timestamp", "id")
+                .values(*fields)[: limit + 1]
+            )
+            has_more = len(page) > limit
+            page = page[:limit]
+            has_older = True
+        else:
+            if before:
+                messages = messages.filter(
+                    Q(timestamp__lt=before[0]) | Q(timestamp=before[0], id__lt=before[1])
+                )
+            # Without a cursor, the latest page
+            page = list(
+                messages.order_by("-timestamp", "-id").values(*fields)[: limit + 1]
+            )
+            has_older = len(page) > limit
+            page = page[:limit][::-1]
+            has_more = bool(before)
+
+        timestamp_field = DateTimeField()
+        for message in page:
+            message["timestamp"] = timestamp_field.to_representation(
+                message["timestamp"]
+            )
 
         # Serialize the conversation and messages
         conversation_data = {
             "client": ClientSerializer(client).data,
             "conversation_id": conversation.id,
             "created_at": conversation.created_at,
-            "messages": MessageSerializer(messages, many=True).data,
+            "messages": page,
+            "cursors": {
+                # older messages: ?before=..., newer ones (polling): ?after=...
+                "before": encode_cursor(page[0]) if page and has_older else None,
+                "after": (
+                    encode_cursor(page[-1])
+                    if page
+                    else request.query_params.get("after")
+                ),
+            },
+            "has_more": has_more,
         }
 
-        return Response(conversation_data, status=status.HTTP_200_OK)
+        response = Response(conversation_data, status=status.HTTP_200_OK)
+        response["ETag"] = etag
+        return response
+
+
+def encode_cursor(message):
+    """Opaque cursor pointing at a message, from its serialized timestamp and id."""
+    value = f"{message['timestamp']}|{message['id']}"
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Return the (timestamp, id) a cursor points at, None without a cursor.
+    Raises ValueError for a malformed cursor.
+    """
+    if not cursor:
+        return None
+    try:
+        value = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, message_id = value.rsplit("|", 1)
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(cursor) from e
+    parsed = parse_datetime(timestamp)
+    if parsed is None:
+        raise ValueError(cursor)
+    return parsed, int(message_id)
+
+
+def sse_event(data, event="message"):
+    """Format `data` as one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class SettledStream:
+    """
+    Streaming response content that settles a token reservation with the
+    `usage` recorded by `events` when the response is closed. The server
+    closes the response when the stream ends or the client goes away, also
+    before the first event was pulled, when the generator body never ran.
+    """
+
+    def __init__(self, events, reservation, usage):
+        self.events = events
+        self.reservation = reservation
+        self.usage = usage
+
+    def __iter__(self):
+        return self.events
+
+    def close(self):
+        try:
+            self.events.close()
+        finally:
+            self.reservation.settle(self.usage["input"] + self.usage["output"])
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncClientConversationView(View):
+    """
+    Async version of ClientConversationView.post. Served by an ASGI worker
+    (core.asgi), a conversation waiting on the AI provider does not hold a
+    worker, so one process can serve many conversations at once.
+    """
+
+    # Methods that call the AI and need tokens reserved by APIKeyMiddleware
+    token_reservation_methods = ("POST",)
+
+    async def post(self, request):
+        if request.content_type == "application/json":
+            try:
+                data = json.loads(request.body or b"{}")
+            except ValueError:
+                return JsonResponse(
+                    {"error": "Request body is not valid JSON."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+        else:
+            data = request.POST
+
+        external_id = data.get("external_id")
+        name = data.get("name")
+        email = data.get("email")
+        user_message = data.get("message")
+
+        if not user_message:
+            return JsonResponse(
+                {"error": "User message is required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            client, created = await sync_to_async(Client.get_or_create_within_limit)(
+                external_id=external_id, defaults={"name": name, "email": email}
+            )
+            if client is None:
+                return JsonResponse(
+                    {"error": "You have exceeded the maximum allowed limit of users."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            conversation, created = await Conversation.objects.aget_or_create(
+                client=client
+            )
+        except Exception as e:
+            return JsonResponse(
+                {"error": f"An error occurred while accessing the client: {str(e)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if not await sync_to_async(conversation.can_send_message)():
+            return JsonResponse(
+                {"error": "Daily message limit reached. Please try again tomorrow."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+        await Message.objects.acreate(
+            conversation=conversation,
+            sender="client",
+            content=user_message,
+            api_key=request.api_key,
+        )
+
+        if settings.HISTORY_ALLOWED:
+            conversation_history = await sync_to_async(
+                lambda: conversation.last_conversation_messages_str
+            )()
+            cacheable = await sync_to_async(conversation.history_turns)() <= 1
+        else:
+            conversation_history = ""
+            cacheable = True
+
+        try:
+            ai_response, token_input, token_output = await aget_ai_response(
+                user_message=user_message,
+                user_history=conversation_history,
+                cacheable=cacheable,
+            )
+            await sync_to_async(request.token_reservation.settle)(
+                token_input + token_output
+            )
+        except Exception as e:
+            return JsonResponse(
+                {"error": f"An error occurred while getting AI response: {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+        await Message.objects.acreate(
+            conversation=conversation,
+            sender="ai",
+            content=ai_response,
+            api_key=request.api_key,
+            input_tokens=token_input,
+        )
+
+        return JsonResponse({"response": ai_response}, status=status.HTTP_200_OK)
 
 
 def chat_view(self, request, conversation_id):
@@ -233,6 +549,8 @@ def chat_view(self, request, conversation_id):
 
 from rest_framework.response import Response
 from rest_framework import status
+from django.db import IntegrityError, transaction
+from .importers import LINK_CONFLICT, catalog_changed, upsert_articles
 from .models import AiData, Category
 from .serializers import AiDataSerializer
 
@@ -264,17 +582,160 @@ class AiDataCreateView(APIView):
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-            # Create the AiData record
-            ai_data = AiData.objects.create(heading=heading, content=content)
-            ai_data.categories.set(categories)  # Associate categories with the AiData
-            ai_data.save()
-
-            # Serialize and return the created AiData
+            # An article stored already is reused and gets the new categories
+            content_hash = AiData.hash_content(heading, content)
+            ai_data = AiData.objects.filter(content_hash=content_hash).first()
+            created = ai_data is None
+            if created:
+                try:
+                    with transaction.atomic():
+                        ai_data = AiData.objects.create(heading=heading, content=content)
+                except IntegrityError:
+                    ai_data = AiData.objects.get(content_hash=content_hash)
+                    created = False
+            if categories:
+                ai_data.categories.add(*categories)
+
+            # Serialize and return the AiData
             serializer = AiDataSerializer(ai_data)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(
+                serializer.data,
+                status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+            )
 
         except Exception as e:
             return Response(
                 {"error": f"An error occurred: {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
+
+
+# Stands for an NDJSON line that could not be parsed
+INVALID_JSON = object()
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AiDataBulkCreateView(View):
+    """
+    Bulk ingest of articles: a JSON array, or an NDJSON body (one article
+    per line, Content-Type application/x-ndjson) that is read as it streams
+    in. Each item is {"heading", "content", "categories": [ids]}; valid items
+    are upserted in batches of INGEST_BATCH_SIZE and the response lists the
+    result of every item in order ("exists" for an article stored already,
+    which gets the item's categories added).
+    """
+
+    def post(self, request):
+        if request.content_type == "application/x-ndjson":
+            items = self.read_ndjson(request)
+        else:
+            try:
+                items = json.loads(request.body)
+            except ValueError:
+                return JsonResponse(
+                    {"error": "Body must be a JSON array or NDJSON."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            if not isinstance(items, list):
+                return JsonResponse(
+                    {"error": "Body must be a JSON array or NDJSON."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+        category_ids = Category.get_all_ids()
+        results = []
+        batch = []  # (index, heading, content, category ids)
+
+        def flush():
+            with transaction.atomic():
+                upserted = upsert_articles(
+                    [
+                        (AiData(heading=heading, content=content), categories)
+                        for _, heading, content, categories in batch
+                    ],
+                    settings.INGEST_BATCH_SIZE,
+                )
+                created_ids = [
+                    article_id for article_id, created in upserted if created
+                ]
+                transaction.on_commit(lambda: catalog_changed(created_ids))
+            for (index, *_), (article_id, created) in zip(batch, upserted):
+                if article_id is None:
+                    results[index] = {
+                        "index": index,
+                        "status": "error",
+                        "error": LINK_CONFLICT,
+                    }
+                    continue
+                results[index] = {
+                    "index": index,
+                    "status": "created" if created else "exists",
+                    "id": article_id,
+                }
+            batch.clear()
+
+        for index, item in enumerate(items):
+            if len(results) >= settings.INGEST_MAX_ITEMS:
+                results.append(
+                    {"index": index, "status": "error", "error": "Too many items."}
+                )
+                break
+            results.append(None)
+            try:
+                batch.append((index, *self.clean_item(item, category_ids)))
+            except ValueError as e:
+                results[index] = {"index": index, "status": "error", "error": str(e)}
+                continue
+            if len(batch) >= settings.INGEST_BATCH_SIZE:
+                flush()
+        if batch:
+            flush()
+
+        created = sum(result["status"] == "created" for result in results)
+        duplicates = sum(result["status"] == "exists" for result in results)
+        return JsonResponse(
+            {
+                "created": created,
+                "duplicates": duplicates,
+                "errors": len(results) - created - duplicates,
+                "results": results,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    @staticmethod
+    def read_ndjson(request):
+        for line in request:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield INVALID_JSON  # reported as an invalid item
+
+    @staticmethod
+    def clean_item(item, category_ids):
+        """
+        Return (heading, content, category ids) of an item, or raise ValueError.
+        """
+        if item is INVALID_JSON:
+            raise ValueError("Invalid JSON.")
+        if not isinstance(item, dict):
+            raise ValueError("Item must be a JSON object.")
+        heading = item.get("heading")
+        content = item.get("content")
+        if not isinstance(heading, str) or not isinstance(content, str):
+            raise ValueError("Both 'heading' and 'content' are required fields.")
+        if not heading.strip() or not content.strip():
+            raise ValueError("Both 'heading' and 'content' are required fields.")
+
+        categories = item.get("categories", [])
+        if not isinstance(categories, list) or not all(
+            isinstance(category_id, int) for category_id in categories
+        ):
+            raise ValueError("'categories' must be a list of category IDs.")
+        if not set(categories) <= category_ids:
+            raise ValueError("One or more category IDs are invalid.")
+        return heading, content, categories
+
@@ -4,6 +4,74 @@ BASE_URL = "daryo-api"
 SITE_URL = "http://176.98.237.4"
 CLIENTS_COUNT = 1000000
 
+# seconds a resolved API key is cached before it is re-read from the database
+API_KEY_CACHE_TTL = 60
+# request counters are written to the database every N seconds or N requests
+REQUEST_COUNTER_FLUSH_INTERVAL = 5
+REQUEST_COUNTER_FLUSH_SIZE = 100
+TOKEN_COUNTER_FLUSH_SIZE = 50000
+# tokens reserved for a request before the AI is called, settled to the real usage after
+TOKEN_RESERVATION_ESTIMATE = 500
+# seconds the daily message limits (UsageLimit) are cached in each process
+USAGE_LIMIT_CACHE_TTL = 300
+# seconds the category/heading catalog strings are cached; they are also
+# dropped whenever AiData or Category change
+CATALOG_CACHE_TTL = 600
+
+# how the article an answer is based on is chosen: "llm" asks the model to pick a
+# category and then a heading, "bm25" and "vector" search a local index of AiData
+RETRIEVAL_STRATEGY = "llm"
+# number of articles passed to the model by local retrieval strategies
+RETRIEVAL_TOP_K = 1
+# seconds after which a local index is rebuilt in the background, in case it missed
+# a change; article changes made anywhere are applied to it as they happen
+RETRIEVAL_INDEX_MAX_AGE = 600
+# most article changes an index applies one by one to catch up, and seconds they are
+# logged for; an index further behind is rebuilt in the background
+RETRIEVAL_MAX_CHANGES = 200
+RETRIEVAL_CHANGE_LOG_TTL = 3600
+# embedder used by the "vector" strategy, its vectors are stored in VECTOR_INDEX_DIR
+VECTOR_EMBEDDER = "api.retrieval.HashingEmbedder"
+# AI prices in $ per million tokens, used for the usage rollup and admin costs
+INPUT_TOKEN_PRICE = 0.150
+OUTPUT_TOKEN_PRICE = 0.600
+# articles inserted per batch by the bulk ingest endpoint, and the most accepted per request
+INGEST_BATCH_SIZE = 500
+INGEST_MAX_ITEMS = 50000
+# messages returned per page by GET ai/conversation/, and the most a client may ask for
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_PAGE_SIZE_MAX = 200
+# counts tokens for budgets and usage: api.tokenizer.RegexTokenizer is a local,
+# uncalibrated estimate; api.tokenizer.TiktokenTokenizer is exact for the OpenAI
+# models but needs tiktoken and its vocabulary (see TIKTOKEN_CACHE_DIR). Stored
+# counts are on the old scale after a change, run the recount_tokens command
+TOKENIZER = "api.tokenizer.RegexTokenizer"
+# bytes of answers kept per process for questions asked at the start of a
+# conversation; they are also shared through the cache for CATALOG_CACHE_TTL seconds
+ANSWER_CACHE_MAX_BYTES = 16 * 1024 * 1024
+# bytes of articles kept per process for AiData.getData
+ARTICLE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# seconds to wait for a connection to an AI provider and for its answer
+LLM_CONNECT_TIMEOUT = 5
+LLM_READ_TIMEOUT = 60
+LLM_MAX_RETRIES = 2
+# keep-alive pool of HTTP connections to the OpenAI API, per process
+LLM_MAX_CONNECTIONS = 100
+LLM_MAX_KEEPALIVE_CONNECTIONS = 20
+LLM_KEEPALIVE_EXPIRY = 30
+# number of Gemini model objects (one per system instruction) kept for reuse
+LLM_MODEL_POOL_SIZE = 256
+
+# hedged requests: when Gemini has not answered after its p95 latency, the same
+# prompt is sent to GPT and the first answer wins
+LLM_HEDGING = False
+# delay used until LLM_HEDGE_MIN_SAMPLES calls have been timed
+LLM_HEDGE_DELAY = 3
+LLM_HEDGE_MIN_SAMPLES = 20
+# threads running hedged provider calls, per process
+LLM_HEDGE_WORKERS = 32
+
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -127,6 +195,13 @@ MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
 STATIC_URL = f"{BASE_URL}/static/"
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
+
+VECTOR_INDEX_DIR = os.path.join(BASE_DIR, "vector_index")
+# seconds one process may hold the lock for building the vector index
+VECTOR_INDEX_BUILD_TIMEOUT = 600
+# seconds a request waits for the vector index of a new process before searching
+# the BM25 index instead
+VECTOR_INDEX_WAIT = 5
 # STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 
 
@@ -136,12 +211,16 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 
-CACHES = {
-    "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",  # In-memory cache
-        "LOCATION": "unique-snowflake",  # A unique identifier for this cache instance
-    }
-}
+from api.cache_backends import cache_settings
+
+# Cache shared by all workers of the gunicorn services (see manage.sh), so a
+# change made through one is seen by all: a SQLite file on this host by
+# default, "redis://host:6379/0" for Redis, "locmem://" for a cache per process
+CACHE_URL = os.getenv("CACHE_URL", f"sqlite:///{BASE_DIR / 'cache.sqlite3'}")
+CACHES = {"default": cache_settings(CACHE_URL)}
+# seconds a process trusts its copy of a cache version (see api.cache) before
+# it checks the shared cache again; 0 checks on every use
+CACHE_VERSION_CHECK_INTERVAL = 1
 
 JAZZMIN_SETTINGS = {
     "site_title": "Daryo admin panel",  # The title in the browser tab